@@ -0,0 +1,63 @@
+"""
+Benchmark of PDF rasterization under different image policies: pages per second
+and the size of each page as stored and as sent to the Table Recognition API
+(base64). Needs poppler. Uses the given PDF, or generates a synthetic table PDF.
+
+    python benchmarks/bench_rasterization.py --pdf quote.pdf --threads 4
+    python benchmarks/bench_rasterization.py --pages 20
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_processing import ImagePolicy, iter_pdf_pages, RENDER_THREADS
+from synthetic_documents import synthetic_pdf
+
+POLICIES = {
+    "png-300": ImagePolicy(dpi=300),
+    "png-200": ImagePolicy(dpi=200),
+    "png-max2000": ImagePolicy(dpi=300, max_dimension=2000),
+    "jpeg-200-q85": ImagePolicy(dpi=200, image_format="JPEG", quality=85),
+    "jpeg-150-gray": ImagePolicy(dpi=150, grayscale=True, image_format="JPEG", quality=85),
+    "webp-200": ImagePolicy(dpi=200, image_format="WEBP", quality=85),
+}
+
+def run_policy(file_bytes, policy, threads):
+    start = time.perf_counter()
+    pages = iter_pdf_pages(file_bytes, policy, thread_count=threads)
+    page_count = next(pages)
+    stored = 0
+    for _, image in pages:
+        stored += len(policy.encode(image))
+        image.close()
+    elapsed = time.perf_counter() - start
+    return page_count, elapsed, stored
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to rasterize; a synthetic one is generated if omitted.")
+    parser.add_argument("--pages", type=int, default=10, help="Pages in the synthetic PDF.")
+    parser.add_argument("--threads", type=int, default=RENDER_THREADS, help="Pages rendered concurrently.")
+    parser.add_argument("--policy", action="append", choices=sorted(POLICIES), help="Policies to run; all by default.")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            file_bytes = f.read()
+    else:
+        file_bytes = synthetic_pdf(args.pages)
+
+    print(f"{'policy':<16}{'pages/s':>10}{'KB/page':>10}{'b64 KB/page':>13}")
+    for name in args.policy or POLICIES:
+        page_count, elapsed, stored = run_policy(file_bytes, POLICIES[name], args.threads)
+        per_page = stored / page_count
+        # The API receives the image base64-encoded inside a JSON body
+        encoded = len(base64.b64encode(b"\0" * int(per_page)))
+        print(f"{name:<16}{page_count / elapsed:>10.2f}{per_page / 1024:>10.1f}{encoded / 1024:>13.1f}")
+
+if __name__ == "__main__":
+    main()
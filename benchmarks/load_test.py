@@ -0,0 +1,269 @@
+"""
+End-to-end load test of the image pipeline: each simulated user uploads a synthetic
+table PDF to /process_pdf, extracts every page through /extract_tables and merges
+them with /collate_tables, against the local mock layout-parsing API. Reports
+p50/p95 latency and bytes sent/received per stage, pages per second and peak RSS,
+and writes everything to a JSON file so runs can be compared. Needs poppler.
+
+    python benchmarks/load_test.py --documents 8 --pages 5 --concurrency 4 --latency 0.3
+    python benchmarks/load_test.py --error-rate 0.1 --compare benchmarks/results/previous.json
+
+By default the app runs in-process with isolated caches. With --base-url the
+requests go to a running server instead, which must itself point at the mock
+(see mock_layout_api.py); RSS is then only that of this harness.
+"""
+import io
+import os
+import math
+import sys
+import json
+import time
+import uuid
+import resource
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_layout_api import MockLayoutAPI, load_sample_pages
+from synthetic_documents import synthetic_pdf
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class StageStats:
+    """Latencies and payload sizes of every call made to one endpoint, shared across user threads."""
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, sent, received, ok):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes_sent += sent
+            self.bytes_received += received
+            if not ok:
+                self.failures += 1
+
+    def summary(self):
+        return {
+            "count": len(self.latencies),
+            "failures": self.failures,
+            "p50_ms": _ms(percentile(self.latencies, 0.50)),
+            "p95_ms": _ms(percentile(self.latencies, 0.95)),
+            "mean_ms": _ms(sum(self.latencies) / len(self.latencies)) if self.latencies else None,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+class InProcessClient:
+    """Drives the Flask app through its test client, so no server has to be started."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, form=None, files=None, json_body=None):
+        if json_body is not None:
+            response = self.client.post(path, json=json_body)
+        else:
+            data = dict(form or {})
+            for field, (filename, content) in (files or {}).items():
+                data[field] = (io.BytesIO(content), filename)
+            response = self.client.post(path, data=data)
+        return response.status_code, response.get_data()
+
+class HTTPClient:
+    """Drives a running server over HTTP."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def post(self, path, form=None, files=None, json_body=None):
+        response = self.session.post(self.base_url + path, data=form, files=files, json=json_body, timeout=600)
+        return response.status_code, response.content
+
+def _request_size(form=None, files=None, json_body=None):
+    if json_body is not None:
+        return len(json.dumps(json_body))
+    size = sum(len(k) + len(str(v)) for k, v in (form or {}).items())
+    return size + sum(len(content) for _, content in (files or {}).values())
+
+def _ndjson_records(body):
+    return [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+
+def _no_error_records(body):
+    # A streamed /process_pdf answers 200 before rendering, so failures arrive as {"error"} records
+    return not any("error" in record for record in _ndjson_records(body))
+
+def timed_post(client, stats, path, succeeded=None, **kwargs):
+    start = time.perf_counter()
+    status, body = client.post(path, **kwargs)
+    ok = status == 200 and (succeeded is None or succeeded(body))
+    stats.record(time.perf_counter() - start, _request_size(**kwargs), len(body), ok)
+    return status, body
+
+def run_document(client, stages, pdf_bytes, options):
+    """Runs one upload through the full flow; returns the number of pages processed."""
+    status, body = timed_post(
+        client, stages["process_pdf"], "/process_pdf?stream=1",
+        succeeded=_no_error_records, files={"file": ("quote.pdf", pdf_bytes)},
+    )
+    records = _ndjson_records(body)
+    errors = [r["error"] for r in records if "error" in r]
+    if status != 200 or errors:
+        raise RuntimeError(f"/process_pdf failed: {errors or status}")
+    page_ids = [r["page_id"] for r in records if "page_id" in r]
+
+    html_parts, image_maps = [], []
+    for page_id in page_ids:
+        status, body = timed_post(
+            client, stages["extract_tables"], "/extract_tables",
+            form={"page_id": page_id, "options": json.dumps(options)},
+        )
+        if status == 200:
+            table = json.loads(body)
+            html_parts.append(table.get("html", ""))
+            image_maps.append(table.get("images", {}))
+
+    status, _ = timed_post(
+        client, stages["collate_tables"], "/collate_tables",
+        json_body={"html_parts": html_parts, "image_maps": image_maps},
+    )
+    if status != 200:
+        raise RuntimeError(f"/collate_tables failed with status {status}")
+    return len(page_ids)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, previous):
+    """Prints the change of the headline numbers against an earlier results file."""
+    def change(new, old):
+        if not new or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {previous.get('label')} ({previous.get('git_revision')}, {previous.get('started_at')}):")
+    print(f"  pages/s: {current['pages_per_second']} vs {previous.get('pages_per_second')} ({change(current['pages_per_second'], previous.get('pages_per_second'))})")
+    for name, stats in current["stages"].items():
+        old = previous.get("stages", {}).get(name, {})
+        print(f"  {name:<16} p50 {change(stats['p50_ms'], old.get('p50_ms')):>8}  p95 {change(stats['p95_ms'], old.get('p95_ms')):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=4, help="PDFs to process in total.")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per PDF.")
+    parser.add_argument("--rows", type=int, default=30, help="Table rows per page.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Simulated users working at the same time.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock API latency per request in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock API requests that fail.")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--base-url", help="Test a running server instead of the in-process app.")
+    parser.add_argument("--label", default="load-test", help="Name stored with the results.")
+    parser.add_argument("--output", help="Results file; defaults to benchmarks/results/<label>-<time>.json.")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    api = MockLayoutAPI(load_sample_pages(), args.latency, args.error_rate, args.error_status)
+    if args.base_url:
+        client_factory = lambda: HTTPClient(args.base_url)
+    else:
+        server = api.serve()
+        # Fresh caches, so every run measures real rendering and API calls
+        os.environ["TABLE_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/layout-parsing"
+        os.environ["TABLE_API_TOKEN"] = "load-test"
+        os.environ["RESULT_CACHE_BACKEND"] = "memory"
+        os.environ["PAGE_CACHE_DIR"] = tempfile.mkdtemp(prefix="salestimate_load_test_")
+        os.environ["JOBS_DB_PATH"] = os.path.join(os.environ["PAGE_CACHE_DIR"], "jobs.sqlite3")
+        os.environ["COLLATION_DB_PATH"] = os.path.join(os.environ["PAGE_CACHE_DIR"], "collation.sqlite3")
+        from main import app
+        client_factory = lambda: InProcessClient(app)
+
+    run_id = uuid.uuid4().hex[:8]
+    documents = [synthetic_pdf(args.pages, args.rows, label=f"{run_id}-{i}-") for i in range(args.documents)]
+    stages = {name: StageStats() for name in ("process_pdf", "extract_tables", "collate_tables")}
+    document_stats = StageStats()
+    local = threading.local()
+
+    def user(pdf_bytes):
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+        start = time.perf_counter()
+        try:
+            pages = run_document(local.client, stages, pdf_bytes, {})
+            ok = True
+        except Exception as e:
+            print(f"Document failed: {e}", file=sys.stderr)
+            pages, ok = 0, False
+        document_stats.record(time.perf_counter() - start, len(pdf_bytes), 0, ok)
+        return pages
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pages_done = sum(executor.map(user, documents))
+    wall = time.perf_counter() - start
+
+    results = {
+        "label": args.label,
+        "started_at": started_at,
+        "git_revision": git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "wall_seconds": round(wall, 3),
+        "pages": pages_done,
+        "pages_per_second": round(pages_done / wall, 3) if wall else None,
+        "documents": document_stats.summary(),
+        "stages": {name: stats.summary() for name, stats in stages.items()},
+        "mock_api": None if args.base_url else {"requests": api.requests, "errors": api.errors, "bytes_received": api.bytes_received},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"{pages_done} pages in {wall:.2f}s, {results['pages_per_second']} pages/s, peak RSS {results['peak_rss_mb']}")
+    print(f"{'stage':<16}{'calls':>7}{'fail':>6}{'p50 ms':>10}{'p95 ms':>10}{'sent KB':>10}{'recv KB':>10}")
+    for name, stats in [*results["stages"].items(), ("document", results["documents"])]:
+        print(f"{name:<16}{stats['count']:>7}{stats['failures']:>6}{stats['p50_ms'] or 0:>10.1f}{stats['p95_ms'] or 0:>10.1f}"
+              f"{stats['bytes_sent'] / 1024:>10.1f}{stats['bytes_received'] / 1024:>10.1f}")
+    if results["mock_api"]:
+        print(f"mock API: {api.requests} requests, {api.errors} injected errors, {api.bytes_received / 1024:.1f} KB received")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.label}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
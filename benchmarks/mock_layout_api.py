@@ -0,0 +1,119 @@
+"""
+Local stand-in for the PP-StructureV3 layout-parsing endpoint.
+
+Replays the sample response under "parsing /" for every request, with optional
+artificial latency and error injection so retries, timeouts and concurrency can be
+exercised without a token or paid calls. Point the app at it with:
+
+    python benchmarks/mock_layout_api.py --port 8765 --latency 0.5 --error-rate 0.1
+    TABLE_API_URL=http://127.0.0.1:8765/layout-parsing TABLE_API_TOKEN=dummy flask --app main run
+"""
+import io
+import os
+import json
+import base64
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pypdf import PdfReader
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "parsing ", "borderless.png_by_PP-StructrueV3.json")
+
+def load_sample_pages(path=SAMPLE_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class MockLayoutAPI:
+    """Holds the replayed pages, the fault-injection settings and request counters."""
+
+    def __init__(self, pages, latency=0.0, error_rate=0.0, error_status=503, fail_first=0):
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Deterministic fault injection: the first fail_first requests get error_status
+        self.fail_first = fail_first
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def handle(self, payload, body_size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += body_size
+            fail = self.requests <= self.fail_first or random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return self.error_status, {"logId": str(uuid.uuid4()), "errorCode": self.error_status, "errorMsg": "Injected failure"}
+        if payload.get("fileType") == 0:
+            # PDFs get one result per page, like the real service
+            page_count = len(PdfReader(io.BytesIO(base64.b64decode(payload["file"]))).pages)
+            pages = [self.pages[i % len(self.pages)] for i in range(page_count)]
+            result = {"layoutParsingResults": pages, "dataInfo": {"type": "pdf", "numPages": page_count}}
+        else:
+            result = {"layoutParsingResults": self.pages[:1], "dataInfo": {"type": "image"}}
+        return 200, {"logId": str(uuid.uuid4()), "errorCode": 0, "errorMsg": "Success", "result": result}
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Starts the server on a background thread and returns it; port 0 picks a free port."""
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if not self.headers.get("Authorization", "").startswith("token "):
+                    status, response = 403, {"errorCode": 403, "errorMsg": "Missing token"}
+                else:
+                    try:
+                        status, response = api.handle(json.loads(body), length)
+                    except ValueError:
+                        status, response = 422, {"errorCode": 422, "errorMsg": "Invalid JSON"}
+                data = json.dumps(response).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, e.g. after its read timeout
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering each request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status.")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    api = MockLayoutAPI(load_sample_pages(), args.latency, args.error_rate, args.error_status)
+    server = api.serve(args.host, args.port)
+    print(f"Mock layout-parsing API listening on http://{args.host}:{server.server_address[1]}/layout-parsing")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
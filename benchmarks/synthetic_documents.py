@@ -0,0 +1,31 @@
+"""Synthetic quotation PDFs for the benchmarks, generated with Pillow."""
+import io
+
+from PIL import Image, ImageDraw
+
+def synthetic_pdf(pages, rows=30, label=""):
+    """
+    Returns the bytes of an A4 PDF with a ruled quotation-style table on every page.
+    The label is printed into each row, so documents with different labels have
+    different bytes and do not share cache entries.
+    """
+    images = []
+    for page in range(pages):
+        image = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(image)
+        top, row_height, columns = 120, 48, [80, 180, 700, 860, 1020, 1160]
+        for row in range(rows + 1):
+            y = top + row * row_height
+            draw.line([(columns[0], y), (columns[-1], y)], fill="black", width=2)
+            if row < rows:
+                cells = ["Item", "Description", "Qty", "Rate", "Amount"] if row == 0 else [
+                    str(row), f"Product {label}{page}-{row}", str(row % 7 + 1), f"{row * 12.5:.2f}", f"{row * 12.5 * (row % 7 + 1):.2f}"]
+                for x, text in zip(columns, cells):
+                    draw.text((x + 10, y + 16), text, fill="black")
+        for x in columns:
+            draw.line([(x, top), (x, top + rows * row_height)], fill="black", width=2)
+        images.append(image)
+
+    buffered = io.BytesIO()
+    images[0].save(buffered, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffered.getvalue()
@@ -0,0 +1,312 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from table_collation import parse_table_rows, filter_page_rows, header_signature
+
+COLLATION_DB_PATH = os.environ.get("COLLATION_DB_PATH", os.path.join(tempfile.gettempdir(), "salestimate_collation.sqlite3"))
+COLLATION_RETENTION_SECONDS = int(os.environ.get("COLLATION_RETENTION_SECONDS", 24 * 3600))
+# Bumped whenever the stored layout changes
+COLLATION_SCHEMA_VERSION = 2
+
+# Session IDs are job IDs or client-generated UUIDs; short, guessable IDs are refused
+SESSION_ID_PATTERN = re.compile(r"^[0-9A-Za-z_-]{16,128}$")
+# Plain amounts such as 1,250.00 or 42; codes with leading zeros stay text
+NUMBER_PATTERN = re.compile(r"^-?(?:0|[1-9]\d{0,2}(?:,\d{3})+|[1-9]\d*)(?:\.\d+)?$")
+
+def is_valid_session_id(session_id):
+    return bool(session_id) and SESSION_ID_PATTERN.match(session_id) is not None
+
+def _headers_for(final_header_texts, first_row):
+    if not final_header_texts and first_row is not None:
+        return [f"Column {i+1}" for i in range(len(first_row))]
+    return final_header_texts
+
+def _pad(row, num_columns):
+    return row + [''] * (num_columns - len(row))
+
+class CollationStore:
+    """
+    Server-side collation sessions, one per table being built from a document (keyed by
+    the ID of the job that started it or a client-generated ID, with the source document
+    kept alongside); later jobs and single-page upserts can add to or replace pages of
+    an existing session. Each page's parsed rows and its filtered row block are stored,
+    so adding, replacing or removing one page re-filters only that page and the pages
+    after it (a page's header only affects later pages) without re-parsing any HTML,
+    and only the blocks that changed are returned. The full table is assembled from
+    the stored blocks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._transaction()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < COLLATION_SCHEMA_VERSION:
+                # Sessions are short-lived, so ones stored in an older layout are dropped rather than migrated
+                conn.execute("DROP TABLE IF EXISTS collation_pages")
+                conn.execute("DROP TABLE IF EXISTS collation_sessions")
+                conn.execute(f"PRAGMA user_version = {COLLATION_SCHEMA_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS collation_sessions ("
+                "id TEXT PRIMARY KEY, document_id TEXT, header_texts TEXT NOT NULL, headers TEXT NOT NULL, "
+                "row_count INTEGER NOT NULL DEFAULT 0, first_row_page INTEGER, first_row TEXT, updated_at REAL NOT NULL)"
+            )
+            # The small columns come first so queries over them don't read the stored rows
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS collation_pages ("
+                "session_id TEXT NOT NULL, page_number INTEGER NOT NULL, header_texts TEXT, signature TEXT, "
+                "row_count INTEGER NOT NULL DEFAULT 0, block TEXT NOT NULL, rows TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, page_number))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS collation_sessions_updated_at ON collation_sessions (updated_at)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        # Take the write lock up front so concurrent upserts to one session serialise
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def upsert_page(self, session_id, page_number, html_part, image_map, document_id=None):
+        """
+        Stores (or replaces) one page's table and returns the resulting changes. The
+        session is created on its first page; document_id is recorded with it, and
+        expired sessions are purged then rather than on every page.
+        """
+        rows = parse_table_rows(html_part, image_map) or []
+        header_texts = json.dumps(rows[0][1]) if rows else None
+        signature = json.dumps(header_signature(rows[0][1])) if rows else None
+        conn = self._transaction()
+        try:
+            now = time.time()
+            if conn.execute("SELECT 1 FROM collation_sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                self._purge_expired(conn, now)
+            conn.execute(
+                "INSERT INTO collation_sessions (id, document_id, header_texts, headers, updated_at) VALUES (?, ?, '[]', '[]', ?) "
+                "ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at, "
+                "document_id = COALESCE(collation_sessions.document_id, excluded.document_id)",
+                (session_id, document_id, now),
+            )
+            # A replaced page keeps its old block until it is re-filtered, so the row count can be adjusted
+            conn.execute(
+                "INSERT INTO collation_pages (session_id, page_number, header_texts, signature, block, rows) "
+                "VALUES (?, ?, ?, ?, '[]', ?) "
+                "ON CONFLICT (session_id, page_number) DO UPDATE SET "
+                "header_texts = excluded.header_texts, signature = excluded.signature, rows = excluded.rows",
+                (session_id, page_number, header_texts, signature, json.dumps(rows)),
+            )
+            changes = self._recollate(conn, session_id, page_number, forced={page_number})
+            conn.execute("COMMIT")
+            return changes
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_page(self, session_id, page_number):
+        """Removes one page and returns the resulting changes, or None if the session does not exist."""
+        conn = self._transaction()
+        try:
+            if conn.execute("SELECT 1 FROM collation_sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                conn.execute("ROLLBACK")
+                return None
+            page = conn.execute(
+                "SELECT row_count FROM collation_pages WHERE session_id = ? AND page_number = ?", (session_id, page_number),
+            ).fetchone()
+            conn.execute("DELETE FROM collation_pages WHERE session_id = ? AND page_number = ?", (session_id, page_number))
+            conn.execute(
+                "UPDATE collation_sessions SET updated_at = ?, row_count = row_count - ? WHERE id = ?",
+                (time.time(), page[0] if page else 0, session_id),
+            )
+            changes = self._recollate(conn, session_id, page_number, forced=set())
+            changes["removed"] = [page_number]
+            conn.execute("COMMIT")
+            return changes
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _recollate(self, conn, session_id, from_page, forced):
+        """
+        Re-filters the pages from from_page onwards against the header signatures of
+        the pages before them, stores the blocks that changed and returns those blocks
+        padded to the header width. Only the pages from from_page onwards are decoded;
+        the session keeps the row count and first row, so the pages before it are only
+        read for their distinct header signatures. If the header itself changes every
+        page is re-filtered and returned.
+        """
+        document_id, old_header_texts, old_headers, row_count, first_row_page, first_row = conn.execute(
+            "SELECT document_id, header_texts, headers, row_count, first_row_page, first_row FROM collation_sessions WHERE id = ?",
+            (session_id,),
+        ).fetchone()
+        old_headers = json.loads(old_headers)
+
+        # The first page with a header row supplies the header every page is filtered against
+        first_header = conn.execute(
+            "SELECT header_texts FROM collation_pages WHERE session_id = ? AND header_texts IS NOT NULL "
+            "AND header_texts != '[]' ORDER BY page_number LIMIT 1",
+            (session_id,),
+        ).fetchone()
+        final_header_texts = json.loads(first_header[0]) if first_header else []
+        if final_header_texts != json.loads(old_header_texts):
+            # A new header changes how every page is filtered
+            from_page = 0
+        processed_header_signatures = {
+            tuple(json.loads(signature)) for (signature,) in conn.execute(
+                "SELECT DISTINCT signature FROM collation_pages WHERE session_id = ? AND page_number < ? AND signature IS NOT NULL",
+                (session_id, from_page),
+            )
+        }
+
+        blocks = {}
+        changed = set(forced)
+        pages = conn.execute(
+            "SELECT page_number, signature, row_count, block, rows FROM collation_pages "
+            "WHERE session_id = ? AND page_number >= ? ORDER BY page_number",
+            (session_id, from_page),
+        ).fetchall()
+        for page_number, signature, old_row_count, block, rows in pages:
+            if signature is not None:
+                processed_header_signatures.add(tuple(json.loads(signature)))
+            new_block = [list(row) for row in filter_page_rows(json.loads(rows), final_header_texts, processed_header_signatures)]
+            encoded = json.dumps(new_block)
+            if encoded != block:
+                conn.execute(
+                    "UPDATE collation_pages SET block = ?, row_count = ? WHERE session_id = ? AND page_number = ?",
+                    (encoded, len(new_block), session_id, page_number),
+                )
+                row_count += len(new_block) - old_row_count
+                changed.add(page_number)
+            blocks[page_number] = new_block
+
+        if first_row_page is None or first_row_page >= from_page:
+            # No page before from_page has rows, so the first row is among the re-filtered pages
+            first_row_page = next((n for n, block in blocks.items() if block), None)
+            first_row = blocks[first_row_page][0][0] if first_row_page is not None else None
+        else:
+            first_row = json.loads(first_row)
+
+        headers = _headers_for(final_header_texts, first_row)
+        headers_changed = headers != old_headers
+        if headers_changed:
+            # Every page is padded to the new width, so the earlier pages are returned as well
+            for page_number, block in conn.execute(
+                "SELECT page_number, block FROM collation_pages WHERE session_id = ? AND page_number < ?", (session_id, from_page),
+            ):
+                blocks[page_number] = json.loads(block)
+            changed = set(blocks)
+        conn.execute(
+            "UPDATE collation_sessions SET header_texts = ?, headers = ?, row_count = ?, first_row_page = ?, first_row = ? WHERE id = ?",
+            (json.dumps(final_header_texts), json.dumps(headers), row_count, first_row_page,
+             json.dumps(first_row) if first_row is not None else None, session_id),
+        )
+
+        num_columns = len(headers)
+        return {
+            "document_id": document_id,
+            "headers": headers,
+            "headers_changed": headers_changed,
+            "pages": [
+                {"page_number": n, "data": [_pad(cells, num_columns) for cells, _ in blocks[n]] if num_columns else []}
+                for n in sorted(changed) if n in blocks
+            ],
+            "page_count": conn.execute("SELECT COUNT(*) FROM collation_pages WHERE session_id = ?", (session_id,)).fetchone()[0],
+            "row_count": row_count,
+        }
+
+    def table(self, session_id, text=False):
+        """
+        Returns the collated {"document_id", "headers", "data"} of a session, or None if it does not
+        exist. With text=True the cells are plain text instead of HTML, for exports.
+        """
+        conn = self._connect()
+        session = conn.execute("SELECT document_id, headers FROM collation_sessions WHERE id = ?", (session_id,)).fetchone()
+        if session is None:
+            return None
+        headers = json.loads(session[1])
+        num_columns = len(headers)
+        data = []
+        if num_columns:
+            for (block,) in conn.execute(
+                "SELECT block FROM collation_pages WHERE session_id = ? ORDER BY page_number", (session_id,),
+            ):
+                data.extend(_pad(texts if text else cells, num_columns) for cells, texts in json.loads(block))
+        return {"document_id": session[0], "headers": headers, "data": data}
+
+    def document_id(self, session_id):
+        """Returns the document a session was started for, or None if it does not exist or has none."""
+        row = self._connect().execute("SELECT document_id FROM collation_sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, session_id):
+        conn = self._transaction()
+        try:
+            conn.execute("DELETE FROM collation_pages WHERE session_id = ?", (session_id,))
+            deleted = conn.execute("DELETE FROM collation_sessions WHERE id = ?", (session_id,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted > 0
+
+    def _purge_expired(self, conn, now):
+        cutoff = now - COLLATION_RETENTION_SECONDS
+        conn.execute("DELETE FROM collation_pages WHERE session_id IN (SELECT id FROM collation_sessions WHERE updated_at < ?)", (cutoff,))
+        conn.execute("DELETE FROM collation_sessions WHERE updated_at < ?", (cutoff,))
+
+# Cell text comes from scanned supplier documents; a spreadsheet would evaluate
+# text starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _is_formula_like(text):
+    return text.startswith(FORMULA_PREFIXES) and not NUMBER_PATTERN.match(text)
+
+def _csv_value(text):
+    return "'" + text if _is_formula_like(text) else text
+
+def table_to_csv(table):
+    buffered = io.StringIO()
+    writer = csv.writer(buffered)
+    writer.writerow([_csv_value(text) for text in table["headers"]])
+    writer.writerows([_csv_value(text) for text in row] for row in table["data"])
+    return buffered.getvalue().encode("utf-8-sig")
+
+def _xlsx_value(sheet, text):
+    if NUMBER_PATTERN.match(text):
+        return float(text.replace(",", ""))
+    if _is_formula_like(text):
+        # Written as an explicit string cell so it is never stored as a formula
+        cell = WriteOnlyCell(sheet, value=text)
+        cell.data_type = "s"
+        return cell
+    return text
+
+def table_to_xlsx(table):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Collated Table")
+    sheet.append([_xlsx_value(sheet, text) for text in table["headers"]])
+    for row in table["data"]:
+        sheet.append([_xlsx_value(sheet, text) for text in row])
+    buffered = io.BytesIO()
+    workbook.save(buffered)
+    return buffered.getvalue()
+
+collation_store = CollationStore(COLLATION_DB_PATH)
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from page_cache import page_cache, make_page_id
+from collation_sessions import collation_store
+from pdf_processing import DEFAULT_IMAGE_POLICY, render_page_to_cache
+from table_recognition import API_CONCURRENCY, submit_extraction, extract_table_from_image_with_cache_hit, api_result_to_table
+
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", os.path.join(tempfile.gettempdir(), "salestimate_jobs.sqlite3"))
+JOB_MAX_ACTIVE = int(os.environ.get("JOB_MAX_ACTIVE", 2))
+JOB_RENDER_PROCESSES = int(os.environ.get("JOB_RENDER_PROCESSES", max(1, (os.cpu_count() or 2) // 2)))
+# A job whose owner has not written a heartbeat for this long is taken over by another worker
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 60))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 24 * 3600))
+# API calls one job may have queued or running on the shared API pool at a time, so
+# requests from other users wait behind at most this many of its pages
+JOB_API_IN_FLIGHT = int(os.environ.get("JOB_API_IN_FLIGHT", API_CONCURRENCY))
+HEARTBEAT_INTERVAL = 5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobStore:
+    """
+    SQLite-backed job state shared by every worker on the host. Progress is written
+    as pages complete, so a job can be polled from any worker and resumed after the
+    worker that owned it restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, doc_hash TEXT NOT NULL, page_numbers TEXT NOT NULL, "
+                "options TEXT NOT NULL, status TEXT NOT NULL, error TEXT, "
+                "pages_done INTEGER NOT NULL DEFAULT 0, errors INTEGER NOT NULL DEFAULT 0, "
+                "render_cache_hits INTEGER NOT NULL DEFAULT 0, result_cache_hits INTEGER NOT NULL DEFAULT 0, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, owner TEXT, heartbeat_at REAL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, session_id TEXT)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "session_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN session_id TEXT")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_pages ("
+                "job_id TEXT NOT NULL, page_number INTEGER NOT NULL, seq INTEGER NOT NULL, "
+                "html TEXT, images TEXT, error TEXT, PRIMARY KEY (job_id, page_number))"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, doc_hash, page_numbers, options, session_id=None):
+        """Creates a queued job whose pages are collated into session_id, or a session keyed by the job ID."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, doc_hash, page_numbers, options, status, created_at, updated_at, session_id) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, doc_hash, json.dumps(page_numbers), json.dumps(options), now, now, session_id or job_id),
+            )
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["page_numbers"] = json.loads(job["page_numbers"])
+        job["options"] = json.loads(job["options"])
+        # Jobs created before sessions could be shared collate into their own
+        job["session_id"] = job["session_id"] or job_id
+        return job
+
+    def pages(self, job_id, since=0, tables=True):
+        """
+        Returns the pages finished after sequence number since. With tables=False only
+        their numbers and errors are returned, for clients that read the collated table instead.
+        """
+        columns = "page_number, seq, html, images, error" if tables else "page_number, seq, error"
+        rows = self._connect().execute(
+            f"SELECT {columns} FROM job_pages WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, since),
+        ).fetchall()
+        pages = []
+        for row in rows:
+            page = {"page_number": row["page_number"], "seq": row["seq"]}
+            if row["error"]:
+                page["error"] = row["error"]
+            elif tables:
+                page["html"] = row["html"]
+                page["images"] = json.loads(row["images"])
+            pages.append(page)
+        return pages
+
+    def done_page_numbers(self, job_id):
+        rows = self._connect().execute("SELECT page_number FROM job_pages WHERE job_id = ?", (job_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def claim(self, job_id, owner):
+        """Atomically takes ownership of a queued job or one whose owner stopped heartbeating."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET owner = ?, heartbeat_at = ?, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running') "
+                "AND (owner IS NULL OR owner = ? OR heartbeat_at < ?)",
+                (owner, now, now, job_id, owner, now - JOB_STALE_SECONDS),
+            )
+        return cursor.rowcount == 1
+
+    def stale_job_ids(self):
+        rows = self._connect().execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (time.time() - JOB_STALE_SECONDS,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def heartbeat(self, job_id, owner):
+        """Refreshes the heartbeat; returns False if the job is no longer owned by this worker."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ?", (now, job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def set_status(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def record_page(self, job_id, page_number, table, render_cache_hit, result_cache_hit):
+        error = table.get("error")
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET pages_done = pages_done + 1, errors = errors + ?, "
+                "render_cache_hits = render_cache_hits + ?, result_cache_hits = result_cache_hits + ?, "
+                "updated_at = ? WHERE id = ?",
+                (1 if error else 0, int(render_cache_hit), int(result_cache_hit), time.time(), job_id),
+            )
+            seq = conn.execute("SELECT pages_done FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page_number, seq, html, images, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, page_number, seq, table.get("html"), json.dumps(table.get("images", {})), error),
+            )
+
+    def request_cancel(self, job_id):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+        return cursor.rowcount == 1
+
+    def is_cancel_requested(self, job_id):
+        row = self._connect().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def purge_expired(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_pages WHERE job_id IN (SELECT id FROM jobs WHERE updated_at < ?)", (cutoff,))
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (cutoff,))
+
+def _extract_page(page_id, options):
+    """Runs on the shared API thread pool: reads a rendered page and sends it to the API."""
+    image_bytes = page_cache.get(page_id)
+    if image_bytes is None:
+        return {"error": "The rendered page was evicted from the cache."}, False
+    api_result, result_cache_hit = extract_table_from_image_with_cache_hit(image_bytes, options)
+    return api_result_to_table(api_result), result_cache_hit
+
+class JobManager:
+    """
+    Runs extraction jobs in the background. Each job is driven by a coordinator
+    thread that renders missing pages on a process pool, sends rendered pages to the
+    API on the shared API thread pool (at most JOB_API_IN_FLIGHT at a time), merges every extracted page into the job's
+    collation session and records it in the job store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._coordinators = ThreadPoolExecutor(max_workers=JOB_MAX_ACTIVE, thread_name_prefix="job")
+        self._render_executor = None
+        self._lock = threading.Lock()
+        self._running = set()
+
+    def _renderer(self):
+        with self._lock:
+            if self._render_executor is None:
+                # Spawn rather than fork: the web worker already runs threads
+                context = multiprocessing.get_context("spawn")
+                self._render_executor = ProcessPoolExecutor(max_workers=JOB_RENDER_PROCESSES, mp_context=context)
+            return self._render_executor
+
+    def submit(self, doc_hash, page_numbers, options, session_id=None):
+        self.store.purge_expired()
+        job_id = self.store.create(doc_hash, page_numbers, options, session_id)
+        self._start(job_id)
+        # Not done at import time: spawned render processes import this module too
+        self.resume_stale_jobs()
+        return job_id
+
+    def _start(self, job_id):
+        with self._lock:
+            if job_id in self._running or not self.store.claim(job_id, self.owner):
+                return False
+            self._running.add(job_id)
+        self._coordinators.submit(self._run, job_id)
+        return True
+
+    def resume_stale_jobs(self):
+        """Picks up jobs left behind by a worker that exited or stopped heartbeating."""
+        for job_id in self.store.stale_job_ids():
+            if self._start(job_id):
+                logging.info(f"Resuming extraction job {job_id}.")
+
+    def _run(self, job_id):
+        try:
+            self._process(job_id)
+        except Exception as e:
+            logging.error(f"Extraction job {job_id} failed: {e}", exc_info=True)
+            self.store.set_status(job_id, "failed", "An unexpected error occurred.")
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _process(self, job_id):
+        # The job may have waited for a free coordinator long enough for another worker to take it
+        if not self.store.claim(job_id, self.owner):
+            return
+        job = self.store.get(job_id)
+        doc_hash, options = job["doc_hash"], job["options"]
+        pdf_path = page_cache.document_path(doc_hash)
+        done = self.store.done_page_numbers(job_id)
+        pending = [n for n in job["page_numbers"] if n not in done]
+        self.store.set_status(job_id, "running")
+        logging.info(f"Extraction job {job_id}: {len(pending)} of {len(job['page_numbers'])} pages to process.")
+
+        render_futures = {}
+        api_futures = {}
+        # Rendered pages waiting for one of the job's API slots, with whether the render was cached
+        ready = deque()
+        for page_number in pending:
+            page_id = make_page_id(doc_hash, page_number, DEFAULT_IMAGE_POLICY.tag)
+            if page_cache.has(page_id):
+                ready.append((page_id, page_number, True))
+            elif pdf_path is None:
+                self.store.record_page(job_id, page_number, {"error": "The source PDF is no longer available."}, False, False)
+            else:
+                future = self._renderer().submit(render_page_to_cache, pdf_path, doc_hash, page_number, DEFAULT_IMAGE_POLICY)
+                render_futures[future] = page_number
+
+        while render_futures or api_futures or ready:
+            if self.store.is_cancel_requested(job_id) or not self.store.heartbeat(job_id, self.owner):
+                for future in list(render_futures) + list(api_futures):
+                    future.cancel()
+                if self.store.is_cancel_requested(job_id):
+                    self.store.set_status(job_id, "cancelled")
+                    logging.info(f"Extraction job {job_id} cancelled.")
+                return
+
+            while ready and len(api_futures) < JOB_API_IN_FLIGHT:
+                page_id, page_number, render_cache_hit = ready.popleft()
+                api_futures[submit_extraction(_extract_page, page_id, options)] = (page_number, render_cache_hit)
+
+            finished, _ = wait(list(render_futures) + list(api_futures), timeout=HEARTBEAT_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in render_futures:
+                    page_number = render_futures.pop(future)
+                    try:
+                        page_id = future.result()
+                    except Exception as e:
+                        logging.error(f"Job {job_id}: rendering page {page_number} failed: {e}")
+                        self.store.record_page(job_id, page_number, {"error": "Failed to render this page."}, False, False)
+                        continue
+                    ready.append((page_id, page_number, False))
+                else:
+                    page_number, render_cache_hit = api_futures.pop(future)
+                    table, result_cache_hit = future.result()
+                    self._collate_page(job_id, job["session_id"], doc_hash, page_number, table)
+                    self.store.record_page(job_id, page_number, table, render_cache_hit, result_cache_hit)
+
+        self.store.set_status(job_id, "completed")
+        logging.info(f"Extraction job {job_id} completed.")
+
+    def _collate_page(self, job_id, session_id, doc_hash, page_number, table):
+        """
+        Merges an extracted page into the job's collation session, replacing an earlier
+        extraction of the same page, so clients read the collated table instead of
+        sending every page's HTML back. A page that failed leaves the session as it was.
+        Done before the page is recorded: a job resumed after a crash in between
+        re-collates it.
+        """
+        if table.get("error"):
+            return
+        try:
+            collation_store.upsert_page(session_id, page_number, table.get("html", ""), table.get("images") or {}, doc_hash)
+        except Exception as e:
+            logging.error(f"Job {job_id}: collating page {page_number} failed: {e}", exc_info=True)
+
+    def status(self, job_id, since=0, tables=True):
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in ACTIVE_STATUSES and job_id not in self._running:
+            # The owning worker may have died; take the job over if its heartbeat is stale
+            self._start(job_id)
+        return {
+            "job_id": job_id,
+            "document_id": job["doc_hash"],
+            "status": job["status"],
+            "error": job["error"],
+            "total_pages": len(job["page_numbers"]),
+            "pages_done": job["pages_done"],
+            "errors": job["errors"],
+            "render_cache_hits": job["render_cache_hits"],
+            "result_cache_hits": job["result_cache_hits"],
+            "cancel_requested": bool(job["cancel_requested"]),
+            "collation_session_id": job["session_id"],
+            "pages": self.store.pages(job_id, since, tables),
+        }
+
+    def cancel(self, job_id):
+        return self.store.request_cancel(job_id)
+
+job_manager = JobManager(JobStore(JOBS_DB_PATH))
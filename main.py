@@ -1,11 +1,19 @@
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, g
+import time
+import cProfile
 import logging
-from pdf_processing import convert_pdf_to_images
-from table_recognition import extract_table_from_image
+from pdf_processing import convert_pdf_to_images, stream_pdf_pages, get_pdf_page_count, parse_page_ranges
+from page_cache import page_cache, document_hash, image_mimetype, is_valid_document_hash
+from jobs import job_manager
+from table_recognition import extract_table_from_image, extract_tables_from_images, extract_tables_from_pdf, api_result_to_table
 import json
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from pypdf.errors import PyPdfError
+from table_collation import collate_html_tables_to_json
+from collation_sessions import collation_store, is_valid_session_id, table_to_csv, table_to_xlsx
+import metrics
+from metrics import stage
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,6 +24,34 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(mes
 
 app = Flask(__name__)
 
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    g.timings = metrics.start_request_timing() if metrics.METRICS_SERVER_TIMING else None
+    g.profiler = None
+    if metrics.should_profile(request.args.get('profile') == '1'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    # Streamed responses are measured up to the first byte; their body is produced later
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.disable()
+        metrics.save_profile(profiler, request.endpoint or 'unknown')
+    endpoint = request.endpoint or 'unknown'
+    if 'request_started' in g:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - g.request_started, endpoint)
+    metrics.HTTP_REQUESTS.inc(endpoint, str(response.status_code))
+    if g.get('timings'):
+        response.headers['Server-Timing'] = metrics.server_timing_header(g.timings)
+    return response
+
+@app.route('/metrics')
+def metrics_route():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -30,62 +66,33 @@ def process_pdf_route():
     if file:
         try:
             file_bytes = file.read()
-            # This function is now updated to return base64 data URLs
-            image_urls = convert_pdf_to_images(file_bytes)
-            return jsonify(image_urls)
+            if request.args.get('stream') == '1':
+                # One JSON object per line, flushed as each page is rendered
+                records = (json.dumps(record) + "\n" for record in stream_pdf_pages(file_bytes))
+                return Response(records, mimetype='application/x-ndjson')
+            # Returns page IDs and URLs into the page cache instead of inline images
+            pages = convert_pdf_to_images(file_bytes)
+            return jsonify(pages)
         except Exception as e:
             logging.critical("Unhandled exception in /process_pdf: %s", e, exc_info=True)
             return jsonify({'error': 'An unexpected error occurred during PDF processing.'}), 500
 
-def collate_html_tables_to_json(html_parts, image_maps):
-    full_image_map = {k: v for d in image_maps for k, v in d.items()}
-    master_table = []
-    final_header_texts = []
-    processed_header_signatures = set()
-
-    for html_part in html_parts:
-        if not html_part or not html_part.strip():
-            continue
-        soup = BeautifulSoup(html_part, 'html.parser')
-        for img in soup.find_all('img'):
-            if img.has_attr('src') and img['src'] in full_image_map:
-                img['src'] = full_image_map[img['src']]
-                img['style'] = 'max-width: 150px; height: auto;'
-        table = soup.find('table')
-        if not table:
-            continue
-        rows = table.find_all('tr')
-        if not rows:
-            continue
-
-        header_row = rows[0]
-        current_header_texts = [ele.text.strip() for ele in header_row.find_all(['th', 'td'])]
-        header_signature = tuple(h.lower() for h in current_header_texts)
-        if not final_header_texts:
-            final_header_texts = current_header_texts
-        processed_header_signatures.add(header_signature)
-
-        for row in rows:
-            row_texts_for_signature = [ele.text.strip().lower() for ele in row.find_all(['td', 'th'])]
-            if tuple(row_texts_for_signature) in processed_header_signatures and tuple(row_texts_for_signature) != tuple(h.lower() for h in final_header_texts):
-                continue
-            if [ele.text.strip() for ele in row.find_all(['th', 'td'])] == final_header_texts:
-                 continue
-
-            cells = [cell.decode_contents() for cell in row.find_all(['td', 'th'])]
-            if any(cells):
-                master_table.append(cells)
-    
-    if not final_header_texts and master_table:
-        final_header_texts = [f"Column {i+1}" for i in range(len(master_table[0]))]
-    
-    num_columns = len(final_header_texts)
-    sanitized_rows = []
-    if num_columns > 0:
-        for row in master_table:
-            sanitized_rows.append(row + [''] * (num_columns - len(row)))
+def _cached_page_response(page_id, kind):
+    data = page_cache.get(page_id, kind)
+    if data is None:
+        return jsonify({'error': 'Page not found. Please upload the PDF again.'}), 404
+    response = Response(data, mimetype=image_mimetype(data))
+    # Page IDs are content-addressed, so the bytes behind a URL never change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/pages/<page_id>')
+def page_image_route(page_id):
+    return _cached_page_response(page_id, 'page')
 
-    return {"headers": final_header_texts, "data": sanitized_rows}
+@app.route('/pages/<page_id>/thumbnail')
+def page_thumbnail_route(page_id):
+    return _cached_page_response(page_id, 'thumbnail')
 
 @app.route('/collate_tables', methods=['POST'])
 def collate_tables_route():
@@ -98,7 +105,8 @@ def collate_tables_route():
     logging.info(f"Received {len(html_parts)} HTML parts and {len(image_maps)} image maps for collation.")
     
     try:
-        table_json = collate_html_tables_to_json(html_parts, image_maps)
+        with stage("collate"):
+            table_json = collate_html_tables_to_json(html_parts, image_maps)
         if not table_json.get("headers") or not table_json.get("data"):
             logging.warning("collate_tables_to_json returned empty or incomplete data.")
             return jsonify({'error': 'Could not find any valid tables to collate.'}), 400
@@ -109,28 +117,26 @@ def collate_tables_route():
 
 @app.route('/extract_tables', methods=['POST'])
 def extract_tables_route():
-    if 'image' not in request.files:
-        return jsonify({'error': 'No image part'}), 400
+    page_id = request.form.get('page_id')
+    if 'image' not in request.files and not page_id:
+        return jsonify({'error': 'No image part or page_id'}), 400
 
-    image = request.files['image']
     options_str = request.form.get('options', '{}')
 
     try:
         options = json.loads(options_str)
-        image_bytes = image.read()
-        api_result = extract_table_from_image(image_bytes, options)
-        
-        if api_result.get('error'):
-            return jsonify({'error': api_result['error']}), 500
-
-        layout_results = api_result.get('result', {}).get('layoutParsingResults', [])
-        if layout_results:
-            first_result = layout_results[0]
-            html_content = first_result.get('html', '')
-            images = first_result.get('images', {})
-            return jsonify({'html': html_content, 'images': images})
+        if 'image' in request.files:
+            image_bytes = request.files['image'].read()
         else:
-            return jsonify({'html': '', 'images': {}})
+            image_bytes = page_cache.get(page_id)
+            if image_bytes is None:
+                return jsonify({'error': 'Page not found. Please upload the PDF again.'}), 404
+        api_result = extract_table_from_image(image_bytes, options)
+        table = api_result_to_table(api_result)
+
+        if table.get('error'):
+            return jsonify({'error': table['error']}), 500
+        return jsonify(table)
 
     except json.JSONDecodeError:
         return jsonify({'error': 'Invalid JSON in options'}), 400
@@ -138,5 +144,233 @@ def extract_tables_route():
         logging.critical("Unhandled exception in /extract_tables: %s", e, exc_info=True)
         return jsonify({'error': 'An unexpected error occurred.'}), 500
 
+MAX_BATCH_PAGES = 50
+
+@app.route('/extract_tables_batch', methods=['POST'])
+def extract_tables_batch_route():
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('page_ids'), list):
+        return jsonify({'error': 'Invalid request. Missing page_ids.'}), 400
+
+    page_ids = data['page_ids']
+    options = data.get('options', {})
+    if not all(isinstance(page_id, str) for page_id in page_ids):
+        return jsonify({'error': 'Invalid request. Every page_id must be a string.'}), 400
+    if not isinstance(options, dict):
+        return jsonify({'error': 'Invalid request. options must be an object.'}), 400
+    if len(page_ids) > MAX_BATCH_PAGES:
+        return jsonify({'error': f'A batch can contain at most {MAX_BATCH_PAGES} pages.'}), 400
+    logging.info(f"Received batch extraction request for {len(page_ids)} pages.")
+
+    try:
+        results = [None] * len(page_ids)
+        found = []
+        for i, page_id in enumerate(page_ids):
+            image_bytes = page_cache.get(page_id)
+            if image_bytes is None:
+                results[i] = {'page_id': page_id, 'error': 'Page not found. Please upload the PDF again.'}
+            else:
+                found.append((i, image_bytes))
+
+        api_results = extract_tables_from_images([image_bytes for _, image_bytes in found], options)
+        for (i, _), api_result in zip(found, api_results):
+            results[i] = {'page_id': page_ids[i], **api_result_to_table(api_result)}
+
+        return jsonify({'results': results})
+    except Exception as e:
+        logging.critical("Unhandled exception in /extract_tables_batch: %s", e, exc_info=True)
+        return jsonify({'error': 'An unexpected error occurred.'}), 500
+
+@app.route('/extract_pdf_tables', methods=['POST'])
+def extract_pdf_tables_route():
+    # Direct PDF pipeline: the selected pages go to the API as a PDF, no local rasterization
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    try:
+        options = json.loads(request.form.get('options', '{}'))
+        file_bytes = file.read()
+        try:
+            page_numbers = parse_page_ranges(request.form.get('pages', ''), get_pdf_page_count(file_bytes))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid page selection: {e}'}), 400
+        logging.info(f"Sending {len(page_numbers)} PDF pages directly to the Table Recognition API.")
+
+        pages = extract_tables_from_pdf(file_bytes, options, page_numbers)
+        extracted = [page for page in pages if page.get('html')]
+        page_errors = [{'page_number': page['page_number'], 'error': page['error']} for page in pages if page.get('error')]
+
+        with stage("collate"):
+            table_json = collate_html_tables_to_json(
+                [page['html'] for page in extracted],
+                [page['images'] for page in extracted],
+            )
+        if not table_json.get("headers") or not table_json.get("data"):
+            error = page_errors[0]['error'] if page_errors else 'Could not find any valid tables to collate.'
+            return jsonify({'error': error, 'page_errors': page_errors}), 400
+        return jsonify({**table_json, 'page_errors': page_errors})
+
+    except json.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON in options'}), 400
+    except PyPdfError as e:
+        logging.warning(f"Could not read uploaded PDF: {e}")
+        return jsonify({'error': 'Invalid PDF'}), 400
+    except Exception as e:
+        logging.critical("Unhandled exception in /extract_pdf_tables: %s", e, exc_info=True)
+        return jsonify({'error': 'An unexpected error occurred.'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def create_job_route():
+    # Either a new upload or the document_id returned by /process_pdf
+    document_id = request.form.get('document_id')
+    uploaded = None
+    if 'file' in request.files and request.files['file'].filename:
+        uploaded = request.files['file'].read()
+        document_id = document_hash(uploaded)
+    elif not is_valid_document_hash(document_id) or page_cache.document_path(document_id) is None:
+        return jsonify({'error': 'No file part or unknown document_id. Please upload the PDF again.'}), 400
+
+    # Pages of a new job can go into the table of an earlier one, replacing re-extracted pages
+    session_id = request.form.get('collation_session_id') or None
+    if session_id is not None:
+        if not is_valid_session_id(session_id):
+            return jsonify({'error': 'Invalid collation session ID.'}), 400
+        if collation_store.document_id(session_id) not in (None, document_id):
+            return jsonify({'error': 'The collation session belongs to another document.'}), 400
+
+    try:
+        options = json.loads(request.form.get('options', '{}'))
+        page_count = page_cache.get_page_count(document_id)
+        if page_count is None:
+            if uploaded is None:
+                with open(page_cache.document_path(document_id), 'rb') as f:
+                    page_count = get_pdf_page_count(f.read())
+            else:
+                page_count = get_pdf_page_count(uploaded)
+            page_cache.set_page_count(document_id, page_count)
+        # An upload is only kept once pypdf could read it (or the same bytes were read before)
+        if uploaded is not None:
+            page_cache.put_document(document_id, uploaded)
+        try:
+            page_numbers = parse_page_ranges(request.form.get('pages', ''), page_count)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid page selection: {e}'}), 400
+
+        job_id = job_manager.submit(document_id, page_numbers, options, session_id)
+        logging.info(f"Created extraction job {job_id} for {len(page_numbers)} pages.")
+        return jsonify({
+            'job_id': job_id, 'document_id': document_id, 'total_pages': len(page_numbers),
+            'collation_session_id': session_id or job_id,
+        }), 202
+    except json.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON in options'}), 400
+    except PyPdfError as e:
+        logging.warning(f"Could not read PDF {document_id}: {e}")
+        return jsonify({'error': 'Invalid PDF'}), 400
+    except Exception as e:
+        logging.critical("Unhandled exception in /jobs: %s", e, exc_info=True)
+        return jsonify({'error': 'An unexpected error occurred.'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    # Only pages finished after the given sequence number are returned, so polling stays cheap;
+    # tables=0 leaves out their HTML for clients that read the collated table instead
+    since = request.args.get('since', 0, type=int)
+    status = job_manager.status(job_id, since, tables=request.args.get('tables') != '0')
+    if status is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_route(job_id):
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished.'}), 404
+    return jsonify({'job_id': job_id, 'cancel_requested': True})
+
+# Collation sessions: pages are merged into a table as they arrive. Jobs collate their
+# pages into the session they were given or one keyed by the job ID; clients that
+# extract pages themselves upsert them under a generated ID
+
+def _collation_session_error(session_id):
+    if not is_valid_session_id(session_id):
+        return jsonify({'error': 'Invalid collation session ID.'}), 400
+    return None
+
+@app.route('/collation/<session_id>/pages/<int:page_number>', methods=['PUT'])
+def upsert_collation_page_route(session_id, page_number):
+    error = _collation_session_error(session_id)
+    if error:
+        return error
+    data = request.get_json(silent=True)
+    if not data or 'html' not in data:
+        return jsonify({'error': 'Invalid request. Missing html.'}), 400
+    if data.get('document_id') is not None and not is_valid_document_hash(data['document_id']):
+        return jsonify({'error': 'Invalid document_id.'}), 400
+
+    try:
+        with stage("collate"):
+            changes = collation_store.upsert_page(
+                session_id, page_number, data['html'], data.get('images') or {}, data.get('document_id'),
+            )
+        return jsonify({'session_id': session_id, **changes})
+    except Exception as e:
+        logging.error(f"Error while collating page {page_number} of collation session {session_id}: {e}", exc_info=True)
+        return jsonify({'error': 'An internal error occurred during table collation.'}), 500
+
+@app.route('/collation/<session_id>/pages/<int:page_number>', methods=['DELETE'])
+def delete_collation_page_route(session_id, page_number):
+    error = _collation_session_error(session_id)
+    if error:
+        return error
+    with stage("collate"):
+        changes = collation_store.delete_page(session_id, page_number)
+    if changes is None:
+        return jsonify({'error': 'Collation session not found.'}), 404
+    return jsonify({'session_id': session_id, **changes})
+
+@app.route('/collation/<session_id>', methods=['GET'])
+def collation_table_route(session_id):
+    error = _collation_session_error(session_id)
+    if error:
+        return error
+    table_json = collation_store.table(session_id)
+    if table_json is None:
+        return jsonify({'error': 'Collation session not found.'}), 404
+    if not table_json.get("headers") or not table_json.get("data"):
+        return jsonify({'error': 'Could not find any valid tables to collate.'}), 400
+    return jsonify(table_json)
+
+@app.route('/collation/<session_id>', methods=['DELETE'])
+def delete_collation_route(session_id):
+    error = _collation_session_error(session_id)
+    if error:
+        return error
+    return jsonify({'session_id': session_id, 'deleted': collation_store.delete(session_id)})
+
+EXPORT_FORMATS = {
+    'csv': (table_to_csv, 'text/csv'),
+    'xlsx': (table_to_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/collation/<session_id>/export', methods=['GET'])
+def export_collation_route(session_id):
+    error = _collation_session_error(session_id)
+    if error:
+        return error
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported export format. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    table_json = collation_store.table(session_id, text=True)
+    if table_json is None:
+        return jsonify({'error': 'Collation session not found.'}), 404
+
+    serialise, mimetype = EXPORT_FORMATS[export_format]
+    response = Response(serialise(table_json), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="collated_table.{export_format}"'
+    return response
+
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
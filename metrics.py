@@ -0,0 +1,213 @@
+import io
+import os
+import time
+import pstats
+import random
+import bisect
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "").lower() in ("1", "true", "yes")
+# Profiling is off unless enabled; then a request is profiled when it asks for it
+# (?profile=1) or is picked by the sample rate
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "salestimate_profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 5e7)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    labels = _format_labels(self.labels + ("le",), label_values + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """A value computed when the metrics are scraped, e.g. a cache hit ratio."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(self.read())}"]
+
+class Registry:
+    """
+    Per-process metric registry rendered in the Prometheus text exposition format.
+    Each gunicorn worker keeps its own values; Prometheus aggregates across the
+    scraped instances.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read):
+        return self.register(Gauge(name, help_text, read))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A failing gauge must not take the whole scrape down
+                continue
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("salestimate_stage_seconds", "Time spent in each processing stage.", ("stage",))
+PAYLOAD_BYTES = registry.histogram("salestimate_payload_bytes", "Size of payloads produced or received per stage.", ("stage",), BYTES_BUCKETS)
+API_REQUESTS = registry.counter("salestimate_api_requests_total", "Table Recognition API calls by outcome.", ("status",))
+API_LATENCY = registry.histogram("salestimate_api_latency_seconds", "Round-trip time of Table Recognition API calls, retries included.", ("file_type",))
+HTTP_REQUESTS = registry.counter("salestimate_http_requests_total", "HTTP requests handled.", ("endpoint", "status"))
+HTTP_LATENCY = registry.histogram("salestimate_http_request_seconds", "Time to produce each HTTP response.", ("endpoint",))
+PAGE_CACHE_LOOKUPS = registry.counter("salestimate_page_cache_lookups_total", "Pages requested for rendering, by whether the page cache already had them.", ("result",))
+RESULT_CACHE_LOOKUPS = registry.counter("salestimate_result_cache_lookups_total", "Table Recognition API result cache lookups by result.", ("result",))
+
+def _hit_ratio(counter):
+    hits, misses = counter.value("hit"), counter.value("miss")
+    return hits / (hits + misses) if hits + misses else 0.0
+
+registry.gauge("salestimate_page_cache_hit_ratio", "Share of page renders avoided by the page cache.", lambda: _hit_ratio(PAGE_CACHE_LOOKUPS))
+registry.gauge("salestimate_result_cache_hit_ratio", "Share of API calls served from the result cache.", lambda: _hit_ratio(RESULT_CACHE_LOOKUPS))
+
+# Stages timed during the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+def start_request_timing():
+    """Begins collecting stage timings for the current request; returns the collector."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def _record_request_timing(name, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        # Stages of one request may run on several executor threads
+        with _timings_lock:
+            total, count = timings.get(name, (0.0, 0))
+            timings[name] = (total + seconds, count + 1)
+
+def server_timing_header(timings):
+    """Formats collected timings as a Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f'{name};dur={total * 1000:.1f};desc="{count}x"' for name, (total, count) in timings.items())
+
+@contextmanager
+def stage(name):
+    """Times a block into the stage histogram and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        _record_request_timing(name, elapsed)
+
+def observe_bytes(name, size):
+    PAYLOAD_BYTES.observe(size, name)
+
+def submit_with_context(executor, fn, *args):
+    """Submits to an executor so the task still reports into the calling request's timings."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def should_profile(requested):
+    if not PROFILE_REQUESTS:
+        return False
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+def save_profile(profiler, label):
+    """
+    Writes a finished cProfile profile to PROFILE_DIR (loadable with pstats or
+    snakeviz), logs its top functions by cumulative time, and returns the file path.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+    logging.info(f"Profile of {label} saved to {path}:\n{summary.getvalue()}")
+    return path
@@ -0,0 +1,199 @@
+import io
+import os
+import re
+import json
+import hashlib
+import time
+import logging
+import tempfile
+import threading
+
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "salestimate_pages"))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Other workers write to the same directory, so the locally tracked size is only an
+# estimate; it is re-measured after this many seconds or this share of max_bytes written
+PAGE_CACHE_RESCAN_SECONDS = int(os.environ.get("PAGE_CACHE_RESCAN_SECONDS", 60))
+PAGE_CACHE_RESCAN_FRACTION = 0.1
+THUMBNAIL_WIDTH = 300
+
+PAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{64}-\d+-[0-9a-z]+$")
+DOCUMENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def document_hash(file_bytes):
+    """Returns the SHA-256 hex digest used to address a PDF and its rendered pages."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def make_page_id(doc_hash, page_number, policy_tag):
+    return f"{doc_hash}-{page_number}-{policy_tag}"
+
+def is_valid_page_id(page_id):
+    return bool(page_id) and PAGE_ID_PATTERN.match(page_id) is not None
+
+def is_valid_document_hash(doc_hash):
+    # Document hashes become file names in the cache directory, so nothing else may get through
+    return isinstance(doc_hash, str) and DOCUMENT_HASH_PATTERN.match(doc_hash) is not None
+
+def image_mimetype(data):
+    """Identifies a cached page's format from its magic bytes; pages may be PNG, JPEG or WebP."""
+    if data[:4] == b"\x89PNG":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+def make_thumbnail(image):
+    """Returns a small JPEG preview of a rendered page."""
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2))
+    buffered = io.BytesIO()
+    thumbnail.save(buffered, format="JPEG", quality=80)
+    return buffered.getvalue()
+
+class PageCache:
+    """
+    Disk-backed, size-bounded store of rendered pages keyed by page ID
+    (PDF hash + page number + image policy tag). Files live in a shared directory so every
+    gunicorn worker sees the same cache; least recently used files are evicted
+    once the directory grows past max_bytes.
+    """
+
+    KINDS = {"page": ".page", "thumbnail": ".jpg"}
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self._unscanned = 0
+        self._scanned_at = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _write(self, path, data):
+        # Write to a temporary file first so readers never see a partial page
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, page_id, kind="page"):
+        if not is_valid_page_id(page_id):
+            return None
+        path = self._path(page_id, self.KINDS[kind])
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Refresh the modification time so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def has(self, page_id):
+        if not is_valid_page_id(page_id):
+            return False
+        # A page about to be extracted counts as used, so eviction must not pick it next
+        try:
+            os.utime(self._path(page_id, self.KINDS["page"]))
+        except OSError:
+            return False
+        return True
+
+    def put(self, page_id, image_bytes, thumbnail_bytes):
+        self._write(self._path(page_id, self.KINDS["thumbnail"]), thumbnail_bytes)
+        self._write(self._path(page_id, self.KINDS["page"]), image_bytes)
+        self._account(len(image_bytes) + len(thumbnail_bytes))
+
+    def put_document(self, doc_hash, file_bytes):
+        """Keeps the source PDF so background jobs can render pages from it later."""
+        if not is_valid_document_hash(doc_hash):
+            raise ValueError("Invalid document hash.")
+        path = self._path(doc_hash, ".pdf")
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            self._write(path, file_bytes)
+            self._account(len(file_bytes))
+
+    def document_path(self, doc_hash):
+        if not is_valid_document_hash(doc_hash):
+            return None
+        path = self._path(doc_hash, ".pdf")
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def get_page_count(self, doc_hash):
+        if not is_valid_document_hash(doc_hash):
+            return None
+        try:
+            with open(self._path(doc_hash, ".json"), "r") as f:
+                return json.load(f)["page_count"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def set_page_count(self, doc_hash, page_count):
+        if not is_valid_document_hash(doc_hash):
+            raise ValueError("Invalid document hash.")
+        self._write(self._path(doc_hash, ".json"), json.dumps({"page_count": page_count}).encode("utf-8"))
+
+    def _account(self, added_bytes):
+        with self._lock:
+            self._unscanned += added_bytes
+            rescan = (
+                self._size is None
+                or self._unscanned >= self.max_bytes * PAGE_CACHE_RESCAN_FRACTION
+                or time.time() - self._scanned_at >= PAGE_CACHE_RESCAN_SECONDS
+            )
+            if rescan:
+                self._size = self._scan_size()
+                self._unscanned = 0
+                self._scanned_at = time.time()
+            else:
+                self._size += added_bytes
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                total += entry.stat().st_size
+        return total
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the limit so a full cache doesn't evict on every put
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._size = total
+        logging.info(f"Page cache evicted {removed} files, {total} bytes remain.")
+
+page_cache = PageCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES)
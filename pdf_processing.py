@@ -1,41 +1,272 @@
-
 import io
-import base64
-from pdf2image import convert_from_bytes
+import os
+import tempfile
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pypdf import PdfReader, PdfWriter
 import logging
+from metrics import stage, observe_bytes, PAGE_CACHE_LOOKUPS
+from page_cache import page_cache, document_hash, make_page_id, make_thumbnail
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def convert_pdf_to_images(file_bytes):
+def _env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+class ImagePolicy:
     """
-    Converts a PDF file into a list of Base64 encoded image data URLs, one for each page.
-    This method is designed for serverless environments where file I/O is restricted.
+    How pages are rasterized and encoded for upload: the target DPI, an optional cap
+    on the longest side in pixels (the DPI is lowered for large pages to respect it),
+    grayscale rendering, and the output format and quality. Lower settings trade
+    recognition quality for smaller uploads and faster rendering.
     """
-    logging.info("Starting PDF to image conversion in-memory.")
-    try:
-        images = convert_from_bytes(file_bytes, dpi=300)
-        image_urls = []
 
-        for i, image in enumerate(images):
-            # Save image to an in-memory buffer
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            
-            # Encode the image to Base64 and create a data URL
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            data_url = f"data:image/png;base64,{img_str}"
-            image_urls.append(data_url)
+    FORMATS = {"PNG": "p", "JPEG": "j", "WEBP": "w"}
+
+    def __init__(self, dpi=300, max_dimension=0, grayscale=False, image_format="PNG", quality=85):
+        image_format = image_format.upper()
+        if image_format == "JPG":
+            image_format = "JPEG"
+        if image_format not in self.FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.dpi = dpi
+        self.max_dimension = max_dimension
+        self.grayscale = grayscale
+        self.image_format = image_format
+        self.quality = quality
+
+    @property
+    def tag(self):
+        """Filename-safe fingerprint used in page IDs, so each policy gets its own cache entries."""
+        tag = str(self.dpi)
+        if self.max_dimension:
+            tag += f"m{self.max_dimension}"
+        if self.grayscale:
+            tag += "g"
+        if self.image_format != "PNG":
+            tag += f"{self.FORMATS[self.image_format]}{self.quality}"
+        return tag
+
+    def dpi_for(self, width_pts, height_pts):
+        """Returns the DPI to render a page of the given size (in points) at."""
+        if not self.max_dimension:
+            return self.dpi
+        return max(36, min(self.dpi, int(self.max_dimension * 72 / max(width_pts, height_pts))))
+
+    def encode(self, image):
+        if self.max_dimension and max(image.size) > self.max_dimension:
+            image.thumbnail((self.max_dimension, self.max_dimension))
+        if self.image_format != "PNG" and image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        buffered = io.BytesIO()
+        with stage("encode"):
+            if self.image_format == "PNG":
+                image.save(buffered, format="PNG")
+            else:
+                image.save(buffered, format=self.image_format, quality=self.quality)
+        observe_bytes("page_image", buffered.tell())
+        return buffered.getvalue()
+
+DEFAULT_IMAGE_POLICY = ImagePolicy(
+    dpi=int(os.environ.get("RENDER_DPI", 300)),
+    max_dimension=int(os.environ.get("RENDER_MAX_DIMENSION", 0)),
+    grayscale=_env_flag("RENDER_GRAYSCALE"),
+    image_format=os.environ.get("UPLOAD_IMAGE_FORMAT", "PNG"),
+    quality=int(os.environ.get("UPLOAD_IMAGE_QUALITY", 85)),
+)
+# Pages rendered concurrently by poppler; also the number of pages held in memory while streaming
+RENDER_THREADS = int(os.environ.get("RENDER_THREADS", min(4, os.cpu_count() or 1)))
+
+def _page_sizes(pdf_source):
+    """Returns the (width, height) in points of every page, read from the PDF structure without rendering."""
+    reader = PdfReader(pdf_source)
+    return [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages]
 
-            logging.info(f"Successfully converted page {i + 1} to a Base64 data URL.")
+def _page_size(pdf_source, page_number):
+    """Returns the (width, height) in points of one 1-based page, without reading the others."""
+    mediabox = PdfReader(pdf_source).pages[page_number - 1].mediabox
+    return float(mediabox.width), float(mediabox.height)
 
-        return {"image_urls": image_urls}
+def _page_record(page_id, page_number):
+    return {
+        "page_number": page_number,
+        "page_id": page_id,
+        "image_url": f"/pages/{page_id}",
+        "thumbnail_url": f"/pages/{page_id}/thumbnail",
+    }
 
+def _conversion_error(e):
+    """Logs a rasterization failure and returns the error dict sent to the client."""
+    # It's crucial to log the specific poppler error if it occurs
+    if "Poppler" in str(e):
+        logging.error("Poppler not found or configured correctly. Ensure it's installed on the system. Error: %s", e, exc_info=True)
+        return {"error": "Server configuration error: Poppler dependency is missing."}
+
+    logging.error("An unexpected error occurred during PDF to image conversion: %s", e, exc_info=True)
+    return {"error": "Failed to convert PDF to images."}
+
+def iter_pdf_pages(file_bytes, policy=DEFAULT_IMAGE_POLICY, skip_page=None, thread_count=RENDER_THREADS):
+    """
+    Yields the page count first, then (page_number, PIL image) tuples in page order.
+    Pages are rendered in runs of up to thread_count consecutive pages, with poppler
+    working on the pages of a run in parallel, so peak memory is bounded by
+    thread_count pages regardless of document length. The PDF is written to a
+    temporary file once. Pages for which skip_page(page_number) is true are yielded
+    as (page_number, None) without rendering.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = os.path.join(temp_dir, "document.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(file_bytes)
+
+        with stage("pdf_info"):
+            page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+        yield page_count
+
+        page_sizes = _page_sizes(pdf_path) if policy.max_dimension else None
+
+        def render_run(run):
+            dpi = min(policy.dpi_for(*page_sizes[n - 1]) for n in run) if page_sizes else policy.dpi
+            with stage("rasterize"):
+                images = convert_from_path(
+                    pdf_path, dpi=dpi, first_page=run[0], last_page=run[-1],
+                    grayscale=policy.grayscale, thread_count=len(run),
+                )
+            return zip(run, images)
+
+        run = []
+        for page_number in range(1, page_count + 1):
+            if skip_page and skip_page(page_number):
+                if run:
+                    yield from render_run(run)
+                    run = []
+                yield page_number, None
+                continue
+            run.append(page_number)
+            if len(run) >= thread_count:
+                yield from render_run(run)
+                run = []
+        if run:
+            yield from render_run(run)
+
+def stream_pdf_pages(file_bytes, policy=DEFAULT_IMAGE_POLICY):
+    """
+    Generator of JSON-serialisable records for the /process_pdf response: a
+    {"document_id", "page_count"} header, then one page record per page as soon as it is available.
+    Rendered pages are stored in the page cache and referenced by page ID, so a PDF
+    that was seen before is served without invoking poppler. On failure a single
+    {"error"} record is emitted.
+    """
+    doc_hash = document_hash(file_bytes)
+    page_cache.put_document(doc_hash, file_bytes)
+    page_count = page_cache.get_page_count(doc_hash)
+    if page_count is not None and all(page_cache.has(make_page_id(doc_hash, n, policy.tag)) for n in range(1, page_count + 1)):
+        logging.info(f"All {page_count} pages of document {doc_hash[:12]} found in the page cache.")
+        PAGE_CACHE_LOOKUPS.inc("hit", amount=page_count)
+        yield {"document_id": doc_hash, "page_count": page_count}
+        for page_number in range(1, page_count + 1):
+            yield _page_record(make_page_id(doc_hash, page_number, policy.tag), page_number)
+        return
+
+    logging.info("Starting streaming PDF to image conversion.")
+    try:
+        pages = iter_pdf_pages(file_bytes, policy, skip_page=lambda n: page_cache.has(make_page_id(doc_hash, n, policy.tag)))
+        page_count = next(pages)
+        page_cache.set_page_count(doc_hash, page_count)
+        yield {"document_id": doc_hash, "page_count": page_count}
+        for page_number, image in pages:
+            page_id = make_page_id(doc_hash, page_number, policy.tag)
+            PAGE_CACHE_LOOKUPS.inc("hit" if image is None else "miss")
+            if image is not None:
+                with stage("thumbnail"):
+                    thumbnail = make_thumbnail(image)
+                page_cache.put(page_id, policy.encode(image), thumbnail)
+                image.close()
+                logging.info(f"Successfully converted page {page_number} and stored it as {page_id}.")
+            yield _page_record(page_id, page_number)
     except Exception as e:
-        # It's crucial to log the specific poppler error if it occurs
-        if "Poppler" in str(e):
-            logging.error("Poppler not found or configured correctly. Ensure it's installed on the system. Error: %s", e, exc_info=True)
-            return {"error": "Server configuration error: Poppler dependency is missing."}
-        
-        logging.error("An unexpected error occurred during PDF to image conversion: %s", e, exc_info=True)
-        return {"error": "Failed to convert PDF to images."}
+        yield _conversion_error(e)
+
+def convert_pdf_to_images(file_bytes):
+    """
+    Converts a PDF file into page records, one for each page. Each record carries the
+    page ID plus URLs for the full-size image and thumbnail served from the page cache.
+    """
+    document_id = None
+    pages = []
+    for record in stream_pdf_pages(file_bytes):
+        if "error" in record:
+            return record
+        if "document_id" in record:
+            document_id = record["document_id"]
+        if "page_id" in record:
+            pages.append(record)
+    return {"document_id": document_id, "pages": pages}
+
+def render_page_to_cache(pdf_path, doc_hash, page_number, policy=DEFAULT_IMAGE_POLICY):
+    """
+    Renders one page of a PDF on disk into the page cache and returns its page ID.
+    Used by the background job worker processes, so it only takes picklable arguments.
+    """
+    page_id = make_page_id(doc_hash, page_number, policy.tag)
+    if not page_cache.has(page_id):
+        dpi = policy.dpi_for(*_page_size(pdf_path, page_number)) if policy.max_dimension else policy.dpi
+        with stage("rasterize"):
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=policy.grayscale)
+        if not images:
+            raise ValueError(f"Page {page_number} could not be rendered.")
+        thumbnail = make_thumbnail(images[0])
+        page_cache.put(page_id, policy.encode(images[0]), thumbnail)
+        images[0].close()
+    return page_id
+
+def parse_page_ranges(spec, page_count):
+    """
+    Parses a page selection such as "1-3,5,8-" into a sorted list of 1-based page
+    numbers. An empty spec selects every page. Raises ValueError for malformed input.
+    """
+    if not spec or not spec.strip():
+        return list(range(1, page_count + 1))
+
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, _, end = part.partition("-")
+                first = int(start) if start.strip() else 1
+                last = int(end) if end.strip() else page_count
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise ValueError(f"Page selection '{part}' is malformed; use page numbers and ranges such as 1-3,5.") from None
+        if first < 1 or last > page_count or first > last:
+            raise ValueError(f"Page range '{part}' is outside 1-{page_count}.")
+        pages.update(range(first, last + 1))
+    return sorted(pages)
+
+def get_pdf_page_count(file_bytes):
+    return len(PdfReader(io.BytesIO(file_bytes)).pages)
+
+def split_pdf(file_bytes, page_numbers, pages_per_chunk):
+    """
+    Yields (page_numbers, pdf_bytes) chunks holding only the selected pages, at most
+    pages_per_chunk per chunk. If the selection is the whole document and fits in one
+    chunk the original bytes are passed through untouched.
+    """
+    reader = PdfReader(io.BytesIO(file_bytes))
+    if page_numbers == list(range(1, len(reader.pages) + 1)) and len(page_numbers) <= pages_per_chunk:
+        yield page_numbers, file_bytes
+        return
+
+    for start in range(0, len(page_numbers), pages_per_chunk):
+        chunk = page_numbers[start:start + pages_per_chunk]
+        writer = PdfWriter()
+        for page_number in chunk:
+            writer.add_page(reader.pages[page_number - 1])
+        buffered = io.BytesIO()
+        with stage("pdf_split"):
+            writer.write(buffered)
+        yield chunk, buffered.getvalue()
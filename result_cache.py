@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from metrics import registry, RESULT_CACHE_LOOKUPS
+
+RESULT_CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND", "sqlite")
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "salestimate_results.sqlite3"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 5000))
+
+def make_cache_key(file_bytes, options, file_type, endpoint=None):
+    """
+    Builds the cache key for a Table Recognition API call from the SHA-256 of the
+    uploaded file and the canonical JSON of the options, so the same page extracted
+    with the same checkboxes maps to the same entry regardless of option order.
+    """
+    canonical_options = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    file_digest = hashlib.sha256(file_bytes).hexdigest()
+    key_material = f"{file_digest}|{file_type}|{endpoint or ''}|{canonical_options}"
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+class MemoryBackend:
+    """In-process LRU backend. Entries are lost on restart and not shared between workers."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def count(self):
+        with self._lock:
+            return len(self._entries)
+
+    def evict(self, max_entries, expired_before):
+        with self._lock:
+            for key in [k for k, (_, stored_at) in self._entries.items() if stored_at < expired_before]:
+                del self._entries[key]
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteBackend:
+    """
+    Persistent backend in a single SQLite file, shared by all workers on the host.
+    Each thread gets its own connection; WAL mode lets readers proceed during writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, stored_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), stored_at, stored_at),
+            )
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def evict(self, max_entries, expired_before):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE stored_at < ?", (expired_before,))
+            conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+class ResultCache:
+    """
+    Cache of Table Recognition API responses with TTL and entry-count eviction.
+    The storage backend is pluggable; hits and misses are counted in the metrics
+    registry, which also exposes the hit ratio and the number of entries.
+    """
+
+    def __init__(self, backend, ttl, max_entries):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _record(self, hit):
+        RESULT_CACHE_LOOKUPS.inc("hit" if hit else "miss")
+
+    def get(self, key):
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            logging.error("Result cache lookup failed: %s", e, exc_info=True)
+            entry = None
+
+        if entry is not None:
+            value, stored_at = entry
+            if time.time() - stored_at <= self.ttl:
+                self._record(True)
+                return value
+            try:
+                self.backend.delete(key)
+            except Exception as e:
+                logging.error("Result cache delete failed: %s", e, exc_info=True)
+        self._record(False)
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        try:
+            self.backend.set(key, value, now)
+            self.backend.evict(self.max_entries, now - self.ttl)
+        except Exception as e:
+            # A broken cache must never fail the extraction itself
+            logging.error("Result cache store failed: %s", e, exc_info=True)
+
+def create_backend(name):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend(RESULT_CACHE_PATH)
+    raise ValueError(f"Unknown result cache backend: {name}")
+
+result_cache = ResultCache(create_backend(RESULT_CACHE_BACKEND), RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES)
+registry.gauge("salestimate_result_cache_entries", "Table Recognition API results held in the result cache.", lambda: result_cache.backend.count())
@@ -0,0 +1,253 @@
+import html
+from html.parser import HTMLParser
+
+VOID_ELEMENTS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+])
+# Row groups end any open row and cell; their tags never become cell content
+TABLE_SECTIONS = frozenset(["thead", "tbody", "tfoot"])
+IMAGE_STYLE = "max-width: 150px; height: auto;"
+MAX_SPAN = 1000
+
+def _span(value):
+    try:
+        return min(max(int(value), 1), MAX_SPAN)
+    except (TypeError, ValueError):
+        return 1
+
+class _Cell:
+    __slots__ = ("html", "text", "colspan", "rowspan")
+
+    def __init__(self, colspan, rowspan):
+        self.html = []
+        self.text = []
+        self.colspan = colspan
+        self.rowspan = rowspan
+
+class TableRowParser(HTMLParser):
+    """
+    Event-based parser that collects the rows of the first top-level <table> in an
+    HTML fragment in a single pass. Each row is a list of cells; a cell keeps its
+    inner HTML (with image sources rewritten through image_map) and its text, plus
+    its colspan/rowspan. Nested tables are kept verbatim inside the enclosing cell.
+    """
+
+    def __init__(self, image_map):
+        super().__init__(convert_charrefs=True)
+        self.image_map = image_map
+        self.rows = []
+        self.found_table = False
+        self._depth = 0
+        self._done = False
+        self._row = None
+        self._cell = None
+
+    def _close_cell(self):
+        if self._cell is not None:
+            self._row.append(self._cell)
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def _start_tag_html(self, tag, attrs, self_closing):
+        if tag == "img":
+            attrs = list(attrs)
+            src_index = next((i for i, (name, _) in enumerate(attrs) if name == "src"), None)
+            if src_index is not None and attrs[src_index][1] in self.image_map:
+                attrs[src_index] = ("src", self.image_map[attrs[src_index][1]])
+                style_index = next((i for i, (name, _) in enumerate(attrs) if name == "style"), None)
+                if style_index is None:
+                    attrs.append(("style", IMAGE_STYLE))
+                else:
+                    attrs[style_index] = ("style", IMAGE_STYLE)
+        parts = [tag]
+        for name, value in attrs:
+            parts.append(name if value is None else f'{name}="{html.escape(value)}"')
+        closing = "/>" if self_closing or tag in VOID_ELEMENTS else ">"
+        return "<" + " ".join(parts) + closing
+
+    def _handle_start(self, tag, attrs, self_closing):
+        if self._done:
+            return
+        if self._depth == 0:
+            if tag == "table":
+                self._depth = 1
+                self.found_table = True
+            return
+
+        if tag == "table" and not self_closing:
+            self._depth += 1
+        # Anything inside a cell, including a nested table, is cell content
+        if self._cell is not None and (self._depth > 1 or (tag not in ("tr", "td", "th") and tag not in TABLE_SECTIONS)):
+            self._cell.html.append(self._start_tag_html(tag, attrs, self_closing))
+            return
+        if self._depth > 1:
+            return
+
+        if tag == "tr":
+            self._close_row()
+            self._row = []
+        elif tag in ("td", "th"):
+            if self._row is None:
+                self._row = []
+            self._close_cell()
+            attr_map = dict(attrs)
+            self._cell = _Cell(_span(attr_map.get("colspan")), _span(attr_map.get("rowspan")))
+        elif tag in TABLE_SECTIONS:
+            self._close_row()
+
+    def handle_starttag(self, tag, attrs):
+        self._handle_start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._handle_start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if self._done or self._depth == 0:
+            return
+        if self._depth > 1:
+            if tag == "table":
+                self._depth -= 1
+            if self._cell is not None:
+                self._cell.html.append(f"</{tag}>")
+            return
+
+        if tag in ("td", "th"):
+            self._close_cell()
+        elif tag == "tr" or tag in TABLE_SECTIONS:
+            self._close_row()
+        elif tag == "table":
+            self._close_row()
+            self._done = True
+        elif self._cell is not None and tag not in VOID_ELEMENTS:
+            self._cell.html.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self._cell is not None and not self._done:
+            self._cell.html.append(html.escape(data, quote=False))
+            self._cell.text.append(data)
+
+def expand_spans(rows):
+    """
+    Lays parsed rows out on a grid, honouring colspan and rowspan. A spanning cell's
+    content sits in its top-left position and the other positions it covers are
+    empty, so amounts in merged cells are not repeated. Returns a list of
+    (cell_html_list, cell_text_list) tuples, one per row.
+    """
+    expanded = []
+    # Column index -> rows still covered by a rowspan from above
+    pending = {}
+    for row in rows:
+        cells_html = []
+        cells_text = []
+
+        def fill_spanned():
+            while len(cells_html) in pending:
+                col = len(cells_html)
+                cells_html.append("")
+                cells_text.append("")
+                pending[col] -= 1
+                if pending[col] == 0:
+                    del pending[col]
+
+        for cell in row:
+            fill_spanned()
+            start = len(cells_html)
+            cells_html.append("".join(cell.html))
+            cells_text.append("".join(cell.text).strip())
+            for _ in range(cell.colspan - 1):
+                col = len(cells_html)
+                # A malformed colspan may overlap a rowspan from above; it consumes that position
+                if col in pending:
+                    pending[col] -= 1
+                    if pending[col] == 0:
+                        del pending[col]
+                cells_html.append("")
+                cells_text.append("")
+            if cell.rowspan > 1:
+                for col in range(start, start + cell.colspan):
+                    pending[col] = cell.rowspan - 1
+        # Rowspans from above that extend past the last cell of this row
+        while pending and max(pending) >= len(cells_html):
+            if len(cells_html) in pending:
+                fill_spanned()
+            else:
+                cells_html.append("")
+                cells_text.append("")
+        expanded.append((cells_html, cells_text))
+    return expanded
+
+def parse_table_rows(html_part, image_map):
+    """
+    Returns the expanded (cell_html_list, cell_text_list) rows of the first table in an
+    HTML fragment, or None if the fragment contains no table.
+    """
+    if not html_part or not html_part.strip():
+        return None
+    parser = TableRowParser(image_map)
+    parser.feed(html_part)
+    parser.close()
+    if not parser.found_table:
+        return None
+    parser._close_row()
+    return expand_spans(parser.rows)
+
+def header_signature(texts):
+    return tuple(t.lower() for t in texts)
+
+def filter_page_rows(rows, final_header_texts, processed_header_signatures):
+    """
+    Returns the (cells_html, cells_text) rows of one page that belong in the master
+    table: repeated header rows are dropped, as are rows whose signature matches
+    the header of this or an earlier page, and rows without any content.
+    """
+    final_signature = header_signature(final_header_texts)
+    kept = []
+    for cells, texts in rows:
+        signature = header_signature(texts)
+        if signature in processed_header_signatures and signature != final_signature:
+            continue
+        if texts == final_header_texts:
+            continue
+        if any(cells):
+            kept.append((cells, texts))
+    return kept
+
+def collate_html_tables_to_json(html_parts, image_maps):
+    """
+    Merges the first table of every HTML part into one master table. The first
+    table's header row becomes the header; repeated header rows on later pages are
+    dropped. Each cell is parsed once and each row's header signature is computed
+    once, so the cost is linear in the size of the input.
+    """
+    full_image_map = {k: v for d in image_maps for k, v in d.items()}
+    master_table = []
+    final_header_texts = []
+    processed_header_signatures = set()
+
+    for html_part in html_parts:
+        rows = parse_table_rows(html_part, full_image_map)
+        if not rows:
+            continue
+
+        current_header_texts = rows[0][1]
+        if not final_header_texts:
+            final_header_texts = current_header_texts
+        processed_header_signatures.add(header_signature(current_header_texts))
+        master_table.extend(cells for cells, _ in filter_page_rows(rows, final_header_texts, processed_header_signatures))
+
+    if not final_header_texts and master_table:
+        final_header_texts = [f"Column {i+1}" for i in range(len(master_table[0]))]
+
+    num_columns = len(final_header_texts)
+    sanitized_rows = []
+    if num_columns > 0:
+        for row in master_table:
+            sanitized_rows.append(row + [''] * (num_columns - len(row)))
+
+    return {"headers": final_header_texts, "data": sanitized_rows}
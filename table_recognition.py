@@ -1,22 +1,85 @@
-
 import base64
 import requests
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+from urllib3.util.retry import Retry
+from result_cache import result_cache, make_cache_key
+from pdf_processing import split_pdf
+from metrics import stage, observe_bytes, submit_with_context, API_REQUESTS, API_LATENCY
 
 API_URL = os.environ.get("TABLE_API_URL")
 TOKEN = os.environ.get("TABLE_API_TOKEN")
+API_TIMEOUT = float(os.environ.get("TABLE_API_TIMEOUT", 120))
+API_MAX_RETRIES = int(os.environ.get("TABLE_API_MAX_RETRIES", 3))
+API_CONCURRENCY = int(os.environ.get("TABLE_API_CONCURRENCY", 4))
+# The service only parses the first 10 pages of a PDF unless reconfigured
+PDF_PAGES_PER_REQUEST = int(os.environ.get("TABLE_API_PDF_PAGES_PER_REQUEST", 10))
 
-def extract_table_from_image(image_bytes, options):
-    """Calls the Table Recognition API to extract tables from an image."""
-    logging.info(f"Sending image to Table Recognition API with options: {options}")
+FILE_TYPE_PDF = 0
+FILE_TYPE_IMAGE = 1
+
+def _create_session():
+    """
+    Builds the shared HTTP session used for every API call. Connections are kept
+    alive and pooled (one slot per concurrent call), and 429/5xx responses and
+    failed connection attempts are retried with exponential backoff, honouring
+    Retry-After when the API sends it. Read timeouts are not retried: the request
+    reached the API, and every retry is another billed call.
+    """
+    retry = Retry(
+        total=None,
+        connect=API_MAX_RETRIES,
+        read=0,
+        status=API_MAX_RETRIES,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_CONCURRENCY, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _is_timeout(error):
+    # With read retries disabled urllib3 reports a read timeout as an exhausted retry,
+    # which requests surfaces as a ConnectionError rather than a Timeout
+    if isinstance(error, requests.Timeout):
+        return True
+    reason = error.args[0] if isinstance(error, requests.ConnectionError) and error.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, ReadTimeoutError)
+
+_session = _create_session()
+# Shared across requests so the process never has more than API_CONCURRENCY calls in flight
+_executor = ThreadPoolExecutor(max_workers=API_CONCURRENCY, thread_name_prefix="table-api")
+
+def _call_layout_api(file_bytes, file_type, options):
+    """
+    Calls the Table Recognition API for a PDF or image, serving repeated calls from the
+    result cache. Returns (result, cache_hit).
+    """
+    cache_key = make_cache_key(file_bytes, options, file_type=file_type, endpoint=API_URL)
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        logging.info("Serving Table Recognition API result from cache.")
+        return cached_result, True
+
+    kind = "PDF" if file_type == FILE_TYPE_PDF else "image"
+    logging.info(f"Sending {kind} to Table Recognition API with options: {options}")
 
     if not API_URL or not TOKEN:
         logging.error("API URL or token not configured. Please set TABLE_API_URL and TABLE_API_TOKEN in your .env file.")
-        return {"error": "API credentials not configured."}
+        return {"error": "API credentials not configured."}, False
 
     try:
-        image_b64 = base64.b64encode(image_bytes).decode("ascii")
+        with stage("base64"):
+            file_b64 = base64.b64encode(file_bytes).decode("ascii")
+        observe_bytes("api_upload", len(file_b64))
 
         headers = {
             "Authorization": f"token {TOKEN}",
@@ -24,20 +87,110 @@ def extract_table_from_image(image_bytes, options):
         }
 
         payload = {
-            "file": image_b64,
-            "fileType": 1,  # 1 for image files
+            "file": file_b64,
+            "fileType": file_type,  # 0 for PDF files, 1 for image files
             **options
         }
 
-        response = requests.post(API_URL, json=payload, headers=headers)
+        start = time.perf_counter()
+        try:
+            with stage("api_request"):
+                response = _session.post(API_URL, json=payload, headers=headers, timeout=API_TIMEOUT)
+        except requests.RequestException as e:
+            API_REQUESTS.inc("timeout" if _is_timeout(e) else "connection_error")
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - start, "pdf" if file_type == FILE_TYPE_PDF else "image")
+        API_REQUESTS.inc(str(response.status_code))
+        observe_bytes("api_response", len(response.content))
 
         if response.status_code == 200:
             logging.info("Successfully received response from Table Recognition API.")
-            return response.json()
+            with stage("json_decode"):
+                result = response.json()
+            result_cache.set(cache_key, result)
+            return result, False
         else:
             logging.error(f"API request failed with status code {response.status_code}: {response.text}")
-            return {"error": f"API request failed: {response.status_code}"}
+            return {"error": f"API request failed: {response.status_code}"}, False
 
+    except requests.RequestException as e:
+        if _is_timeout(e):
+            logging.error(f"Table Recognition API did not respond within {API_TIMEOUT} seconds.")
+            return {"error": "The Table Recognition API timed out."}, False
+        logging.error(f"Could not reach the Table Recognition API: {e}")
+        return {"error": "Could not reach the Table Recognition API."}, False
     except Exception as e:
         logging.critical("An unexpected error occurred while calling the Table Recognition API: %s", e, exc_info=True)
-        return {"error": "An unexpected error occurred."}
+        return {"error": "An unexpected error occurred."}, False
+
+def submit_extraction(fn, *args):
+    """
+    Runs fn on the shared API thread pool and returns its future. Callers that do
+    their own API work in the background (such as extraction jobs) go through here
+    so the process-wide limit of API_CONCURRENCY calls in flight holds.
+    """
+    return submit_with_context(_executor, fn, *args)
+
+def extract_table_from_image(image_bytes, options):
+    """Calls the Table Recognition API to extract tables from an image."""
+    return _call_layout_api(image_bytes, FILE_TYPE_IMAGE, options)[0]
+
+def extract_table_from_image_with_cache_hit(image_bytes, options):
+    """Like extract_table_from_image, but returns (result, cache_hit) for callers that count result cache hits."""
+    return _call_layout_api(image_bytes, FILE_TYPE_IMAGE, options)
+
+def extract_tables_from_images(images, options):
+    """
+    Extracts tables from several images concurrently through the shared session.
+    Results are returned in the same order as the input images.
+    """
+    futures = [submit_with_context(_executor, extract_table_from_image, image_bytes, options) for image_bytes in images]
+    return [future.result() for future in futures]
+
+def extract_tables_from_pdf(file_bytes, options, page_numbers):
+    """
+    Uploads the selected pages of a PDF directly (fileType 0), skipping local
+    rasterization. Pages are sent in chunks of PDF_PAGES_PER_REQUEST, concurrently,
+    and the per-page layoutParsingResults are split back out. Returns one
+    {"page_number", "html", "images"} or {"page_number", "error"} dict per page.
+    """
+    chunks = list(split_pdf(file_bytes, page_numbers, PDF_PAGES_PER_REQUEST))
+    futures = [submit_with_context(_executor, _call_layout_api, chunk_bytes, FILE_TYPE_PDF, options) for _, chunk_bytes in chunks]
+
+    pages = []
+    for (chunk_pages, _), future in zip(chunks, futures):
+        api_result, _ = future.result()
+        if api_result.get("error"):
+            pages.extend({"page_number": n, "error": api_result["error"]} for n in chunk_pages)
+            continue
+
+        layout_results = api_result.get("result", {}).get("layoutParsingResults", [])
+        if len(layout_results) != len(chunk_pages):
+            logging.warning(f"Expected {len(chunk_pages)} page results from the API but received {len(layout_results)}.")
+        for i, page_number in enumerate(chunk_pages):
+            if i < len(layout_results):
+                pages.append({"page_number": page_number, **page_result_to_table(layout_results[i])})
+            else:
+                pages.append({"page_number": page_number, "error": "No result returned for this page."})
+    return pages
+
+def page_result_to_table(page_result):
+    """
+    Returns the {"html", "images"} of one layoutParsingResults entry. The service
+    puts the page HTML and its image map under "markdown"; a top-level "html"/"images"
+    pair is used instead when present.
+    """
+    if "html" in page_result:
+        return {"html": page_result.get("html", ""), "images": page_result.get("images", {})}
+    markdown = page_result.get("markdown") or {}
+    return {"html": markdown.get("text", ""), "images": markdown.get("images", {})}
+
+def api_result_to_table(api_result):
+    """Returns the {"html", "images"} of an image extraction, or the {"error"} it failed with."""
+    if api_result.get("error"):
+        return {"error": api_result["error"]}
+    layout_results = api_result.get("result", {}).get("layoutParsingResults", [])
+    if not layout_results:
+        return {"html": "", "images": {}}
+    return page_result_to_table(layout_results[0])
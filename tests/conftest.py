@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Caches and stores are module-level singletons configured from the environment,
+# so point them at a scratch directory before any app module is imported
+_scratch = tempfile.mkdtemp(prefix="salestimate_tests_")
+os.environ["PAGE_CACHE_DIR"] = os.path.join(_scratch, "pages")
+os.environ["RESULT_CACHE_BACKEND"] = "memory"
+os.environ["JOBS_DB_PATH"] = os.path.join(_scratch, "jobs.sqlite3")
+os.environ["COLLATION_DB_PATH"] = os.path.join(_scratch, "collation.sqlite3")
+
+import pytest
+
+from mock_layout_api import MockLayoutAPI, load_sample_pages
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    """Starts mock layout-parsing servers and points table_recognition at the last one started."""
+    import table_recognition
+    from result_cache import result_cache
+
+    servers = []
+
+    def start(api=None, **settings):
+        api = api or MockLayoutAPI(load_sample_pages(), **settings)
+        server = api.serve()
+        servers.append(server)
+        monkeypatch.setattr(table_recognition, "API_URL", f"http://127.0.0.1:{server.server_address[1]}/layout-parsing")
+        monkeypatch.setattr(table_recognition, "TOKEN", "test-token")
+        return api
+
+    result_cache.backend.clear()
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,94 @@
+import io
+import csv
+import time
+import uuid
+import random
+
+from openpyxl import load_workbook
+
+from table_collation import collate_html_tables_to_json
+from collation_sessions import collation_store, table_to_csv, table_to_xlsx, COLLATION_RETENTION_SECONDS
+
+HEADER_CHOICES = [["Item", "Qty"], ["Name", "Price", "Total"], ["x", "y"]]
+
+def page_html(rng, page_number):
+    header = rng.choice(HEADER_CHOICES)
+    rows = [header] if rng.random() < 0.8 else []
+    rows += [[f"p{page_number}r{r}c{c}" for c in range(rng.randint(1, 4))] for r in range(rng.randint(0, 3))]
+    if not rows:
+        return "<p>no table</p>"
+    return "<table>" + "".join("<tr>" + "".join(f"<td>{c}</td>" for c in row) + "</tr>" for row in rows) + "</table>"
+
+def test_random_upserts_and_deletes_match_a_full_collation():
+    rng = random.Random(11)
+    for _ in range(30):
+        session_id = uuid.uuid4().hex
+        pages = {}
+        client = {}
+        for _ in range(12):
+            page_number = rng.randint(1, 6)
+            if pages and rng.random() < 0.3:
+                page_number = rng.choice(sorted(pages))
+                del pages[page_number]
+                changes = collation_store.delete_page(session_id, page_number)
+            else:
+                pages[page_number] = page_html(rng, page_number)
+                changes = collation_store.upsert_page(session_id, page_number, pages[page_number], {})
+
+            # Replaying only the returned blocks must keep a client copy in sync
+            for removed in changes.get("removed", []):
+                client.pop(removed, None)
+            for page in changes["pages"]:
+                client[page["page_number"]] = page["data"]
+
+            table = collation_store.table(session_id)
+            assert [row for n in sorted(client) for row in client[n]] == table["data"]
+            assert changes["headers"] == table["headers"]
+            assert changes["row_count"] == len(table["data"])
+            assert changes["page_count"] == len(pages)
+
+            expected = collate_html_tables_to_json([pages[n] for n in sorted(pages)], [{}] * len(pages))
+            if expected["data"] or table["data"]:
+                assert {"headers": table["headers"], "data": table["data"]} == expected
+        assert collation_store.delete(session_id)
+
+def test_sessions_of_the_same_document_are_independent():
+    document_id = "c" * 64
+    first, second = uuid.uuid4().hex, uuid.uuid4().hex
+    page = "<table><tr><td>Item</td></tr><tr><td>{}</td></tr></table>"
+
+    collation_store.upsert_page(first, 1, page.format("first"), {}, document_id=document_id)
+    collation_store.upsert_page(second, 1, page.format("second"), {}, document_id=document_id)
+    collation_store.delete_page(second, 1)
+
+    assert collation_store.table(first) == {"document_id": document_id, "headers": ["Item"], "data": [["first"]]}
+    assert collation_store.table(second)["data"] == []
+
+def test_exports_do_not_produce_formulas():
+    table = {"headers": ["=Item", "Amount"], "data": [["=HYPERLINK(\"http://x\")", "-1,250.00"], ["@SUM(A1)", "+1"]]}
+
+    rows = list(csv.reader(io.StringIO(table_to_csv(table).decode("utf-8-sig"))))
+    assert rows == [["'=Item", "Amount"], ["'=HYPERLINK(\"http://x\")", "-1,250.00"], ["'@SUM(A1)", "'+1"]]
+
+    sheet = load_workbook(io.BytesIO(table_to_xlsx(table))).active
+    cells = [[cell for cell in row] for row in sheet.iter_rows()]
+    assert [cell.value for cell in cells[1]] == ["=HYPERLINK(\"http://x\")", -1250.0]
+    assert all(cell.data_type != "f" for row in cells for cell in row)
+
+def test_expired_sessions_are_purged_when_a_session_is_created():
+    expired, live = uuid.uuid4().hex, uuid.uuid4().hex
+    page = "<table><tr><td>Item</td></tr><tr><td>a</td></tr></table>"
+    collation_store.upsert_page(expired, 1, page, {})
+    collation_store.upsert_page(live, 1, page, {})
+    conn = collation_store._connect()
+    conn.execute("UPDATE collation_sessions SET updated_at = ? WHERE id = ?",
+                 (time.time() - COLLATION_RETENTION_SECONDS - 1, expired))
+
+    # Further pages of an existing session leave other sessions alone
+    collation_store.upsert_page(live, 2, page, {})
+    assert collation_store.table(expired) is not None
+
+    collation_store.upsert_page(uuid.uuid4().hex, 1, page, {})
+    assert collation_store.table(expired) is None
+    assert collation_store.table(live) is not None
+    assert conn.execute("SELECT COUNT(*) FROM collation_pages WHERE session_id = ?", (expired,)).fetchone()[0] == 0
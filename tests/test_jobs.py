@@ -0,0 +1,192 @@
+import io
+import time
+import uuid
+
+import jobs
+from jobs import job_manager, ACTIVE_STATUSES
+from page_cache import page_cache, make_page_id
+from pdf_processing import DEFAULT_IMAGE_POLICY
+
+def seed_pages(doc_hash, page_count):
+    for n in range(1, page_count + 1):
+        page_cache.put(make_page_id(doc_hash, n, DEFAULT_IMAGE_POLICY.tag), f"page-{n}".encode("ascii"), b"thumbnail")
+
+def seed_document(page_count):
+    """Stores a placeholder PDF with every page already rendered, so jobs never need poppler."""
+    doc_hash = uuid.uuid4().hex * 2
+    page_cache.put_document(doc_hash, b"%PDF-1.4 placeholder")
+    page_cache.set_page_count(doc_hash, page_count)
+    seed_pages(doc_hash, page_count)
+    return doc_hash
+
+def wait_for_job(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_manager.store.get(job_id)
+        if job["status"] not in ACTIVE_STATUSES and job_id not in job_manager._running:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish within {timeout} seconds.")
+
+def test_job_keeps_at_most_its_share_of_api_calls_outstanding(mock_api, monkeypatch):
+    mock_api(latency=0.05)
+    monkeypatch.setattr(jobs, "JOB_API_IN_FLIGHT", 2)
+    outstanding = []
+    peak = []
+    submit = jobs.submit_extraction
+
+    def tracking_submit(fn, *args):
+        outstanding.append(1)
+        peak.append(len(outstanding))
+        future = submit(fn, *args)
+        future.add_done_callback(lambda _: outstanding.pop())
+        return future
+
+    monkeypatch.setattr(jobs, "submit_extraction", tracking_submit)
+    doc_hash = seed_document(8)
+
+    job = wait_for_job(job_manager.submit(doc_hash, list(range(1, 9)), {}))
+
+    assert job["status"] == "completed"
+    assert job["pages_done"] == 8
+    assert max(peak) == 2
+
+def test_job_runs_to_completion_and_pages_are_returned_after_since(mock_api):
+    from main import app
+
+    mock_api()
+    doc_hash = seed_document(3)
+    client = app.test_client()
+
+    response = client.post("/jobs", data={"document_id": doc_hash})
+    assert response.status_code == 202
+    created = response.get_json()
+    assert created["total_pages"] == 3
+    wait_for_job(created["job_id"])
+
+    status = client.get(f"/jobs/{created['job_id']}").get_json()
+    assert status["status"] == "completed"
+    assert (status["pages_done"], status["errors"], status["render_cache_hits"]) == (3, 0, 3)
+    assert sorted(page["page_number"] for page in status["pages"]) == [1, 2, 3]
+    assert [page["seq"] for page in status["pages"]] == [1, 2, 3]
+    assert all("<table" in page["html"] for page in status["pages"])
+
+    later = client.get(f"/jobs/{created['job_id']}?since=1&tables=0").get_json()["pages"]
+    assert [page["seq"] for page in later] == [2, 3]
+    assert all("html" not in page for page in later)
+    assert client.get(f"/jobs/{created['job_id']}?since=3").get_json()["pages"] == []
+
+    # Every extracted page was collated into the job's session on the server
+    table = client.get(f"/collation/{created['collation_session_id']}").get_json()
+    assert table["document_id"] == doc_hash
+    assert table["headers"] and table["data"]
+
+def test_later_job_upserts_into_an_existing_session(mock_api):
+    from main import app
+    from collation_sessions import collation_store
+
+    api = mock_api()
+    doc_hash = seed_document(3)
+    client = app.test_client()
+    first = client.post("/jobs", data={"document_id": doc_hash}).get_json()
+    wait_for_job(first["job_id"])
+    session_id = first["collation_session_id"]
+    rows = len(collation_store.table(session_id)["data"])
+
+    second = client.post("/jobs", data={
+        "document_id": doc_hash, "pages": "2", "options": '{"useDocUnwarping": true}', "collation_session_id": session_id,
+    }).get_json()
+    wait_for_job(second["job_id"])
+
+    assert second["collation_session_id"] == session_id
+    assert api.requests == 4
+    assert len(collation_store.table(session_id)["data"]) == rows
+
+    other = seed_document(1)
+    response = client.post("/jobs", data={"document_id": other, "collation_session_id": session_id})
+    assert response.status_code == 400
+
+def test_cancelled_job_stops_before_its_remaining_pages(mock_api, monkeypatch):
+    from main import app
+
+    mock_api(latency=0.2)
+    monkeypatch.setattr(jobs, "JOB_API_IN_FLIGHT", 1)
+    doc_hash = seed_document(10)
+    client = app.test_client()
+    job_id = client.post("/jobs", data={"document_id": doc_hash}).get_json()["job_id"]
+
+    response = client.post(f"/jobs/{job_id}/cancel")
+    assert response.get_json() == {"job_id": job_id, "cancel_requested": True}
+    job = wait_for_job(job_id)
+
+    assert job["status"] == "cancelled"
+    assert job["pages_done"] < 10
+    assert client.post(f"/jobs/{job_id}/cancel").status_code == 404
+
+def test_stale_owner_is_taken_over_and_only_pending_pages_are_processed(mock_api):
+    api = mock_api()
+    store = job_manager.store
+    doc_hash = seed_document(4)
+    job_id = store.create(doc_hash, [1, 2, 3, 4], {})
+    assert store.claim(job_id, "worker-that-died")
+    store.set_status(job_id, "running")
+    store.record_page(job_id, 1, {"html": "<table><tr><td>Item</td></tr></table>", "images": {}}, True, False)
+
+    # A live owner keeps the job
+    assert not store.claim(job_id, job_manager.owner)
+    job_manager.status(job_id)
+    assert job_manager.store.get(job_id)["owner"] == "worker-that-died"
+
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - jobs.JOB_STALE_SECONDS - 1, job_id))
+    job_manager.status(job_id)
+    job = wait_for_job(job_id)
+
+    assert job["status"] == "completed"
+    assert job["owner"] == job_manager.owner
+    assert job["pages_done"] == 4
+    assert api.requests == 3
+    assert not store.heartbeat(job_id, "worker-that-died")
+
+def test_job_routes_reject_bad_input():
+    from main import app
+
+    client = app.test_client()
+    doc_hash = seed_document(2)
+
+    assert client.post("/jobs", data={}).status_code == 400
+    assert client.post("/jobs", data={"document_id": "../../etc/passwd"}).status_code == 400
+    assert client.post("/jobs", data={"document_id": "0" * 64}).status_code == 400
+    assert client.post("/jobs", data={"document_id": doc_hash, "pages": "3"}).status_code == 400
+    assert client.post("/jobs", data={"document_id": doc_hash, "pages": "1-two"}).status_code == 400
+    assert client.post("/jobs", data={"document_id": doc_hash, "options": "{"}).status_code == 400
+    assert client.post("/jobs", data={"document_id": doc_hash, "collation_session_id": "short"}).status_code == 400
+    assert client.get(f"/jobs/{uuid.uuid4().hex}").status_code == 404
+    assert client.post(f"/jobs/{uuid.uuid4().hex}/cancel").status_code == 404
+
+def test_upload_that_is_not_a_pdf_is_not_stored():
+    from main import app
+    from page_cache import document_hash
+
+    content = b"not a pdf " + uuid.uuid4().bytes
+    response = app.test_client().post("/jobs", data={"file": (io.BytesIO(content), "quote.pdf")})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid PDF"}
+    assert page_cache.document_path(document_hash(content)) is None
+
+def test_uploaded_pdf_is_stored_once_read(mock_api):
+    from main import app
+    from page_cache import document_hash
+    from synthetic_documents import synthetic_pdf
+
+    mock_api()
+    content = synthetic_pdf(2, rows=3, label=uuid.uuid4().hex[:8])
+    seed_pages(document_hash(content), 2)
+
+    response = app.test_client().post("/jobs", data={"file": (io.BytesIO(content), "quote.pdf")})
+
+    assert response.status_code == 202
+    assert response.get_json()["total_pages"] == 2
+    assert page_cache.document_path(document_hash(content)) is not None
+    assert wait_for_job(response.get_json()["job_id"])["status"] == "completed"
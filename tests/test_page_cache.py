@@ -0,0 +1,63 @@
+import os
+
+import page_cache as page_cache_module
+from page_cache import PageCache, make_page_id
+
+def directory_size(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+def test_size_written_by_other_workers_is_picked_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache_module, "PAGE_CACHE_RESCAN_SECONDS", 3600)
+    worker, other_worker = PageCache(str(tmp_path), 10000), PageCache(str(tmp_path), 10000)
+    worker.put(make_page_id("a" * 64, 1, "p"), b"x" * 90, b"x" * 10)
+    other_worker.put(make_page_id("b" * 64, 1, "p"), b"x" * 9000, b"x" * 400)
+
+    # A small write stays within the local estimate
+    worker.put(make_page_id("a" * 64, 2, "p"), b"x" * 500, b"x" * 100)
+    assert directory_size(tmp_path) > 10000
+
+    # Enough local writes force a rescan, which sees the other worker's pages
+    worker.put(make_page_id("a" * 64, 3, "p"), b"x" * 500, b"x" * 100)
+    assert directory_size(tmp_path) <= 9000
+
+def test_page_routes_serve_cached_pages():
+    import uuid
+    from main import app
+    from page_cache import page_cache
+
+    page_id = make_page_id(uuid.uuid4().hex * 2, 1, "p")
+    page_cache.put(page_id, b"\x89PNG page", b"\xff\xd8\xff thumbnail")
+    client = app.test_client()
+
+    response = client.get(f"/pages/{page_id}")
+    assert response.status_code == 200
+    assert response.data == b"\x89PNG page"
+    assert response.mimetype == "image/png"
+    assert "immutable" in response.headers["Cache-Control"]
+
+    response = client.get(f"/pages/{page_id}/thumbnail")
+    assert (response.data, response.mimetype) == (b"\xff\xd8\xff thumbnail", "image/jpeg")
+
+    assert client.get(f"/pages/{make_page_id('0' * 64, 1, 'p')}").status_code == 404
+    assert client.get("/pages/not-a-page-id").status_code == 404
+    assert client.get("/pages/..%2F..%2Fetc%2Fpasswd").status_code == 404
+
+def test_least_recently_used_pages_are_evicted_to_ninety_percent(tmp_path):
+    cache = PageCache(str(tmp_path), 1000)
+    page_ids = [make_page_id("c" * 64, n, "p") for n in range(1, 5)]
+    for n, page_id in enumerate(page_ids):
+        cache.put(page_id, b"x" * 200, b"x" * 50)
+        stamp = 1000000 + n * 100
+        os.utime(cache._path(page_id, ".page"), (stamp, stamp))
+        os.utime(cache._path(page_id, ".jpg"), (stamp, stamp))
+
+    # Checking for a page marks it as used, so the oldest untouched page goes first
+    assert cache.has(page_ids[0])
+    cache.put(make_page_id("d" * 64, 1, "p"), b"x" * 200, b"x" * 50)
+
+    assert directory_size(tmp_path) <= 900
+    assert cache.get(page_ids[0]) is not None
+    assert cache.get(page_ids[1]) is None
+    assert not cache.has(page_ids[1])
+    assert cache.get(page_ids[3]) is not None
+    assert not cache.has("../outside")
@@ -0,0 +1,17 @@
+import pytest
+
+from pdf_processing import parse_page_ranges
+
+def test_page_ranges_select_sorted_unique_pages():
+    assert parse_page_ranges("", 4) == [1, 2, 3, 4]
+    assert parse_page_ranges("3, 1-2,2", 4) == [1, 2, 3]
+    assert parse_page_ranges("-2,4-", 5) == [1, 2, 4, 5]
+
+@pytest.mark.parametrize("spec", ["abc", "1-x", "1.5", "2-3-4"])
+def test_malformed_page_selection_raises_value_error(spec):
+    with pytest.raises(ValueError, match="malformed"):
+        parse_page_ranges(spec, 5)
+
+def test_pages_outside_the_document_are_rejected():
+    with pytest.raises(ValueError, match="outside 1-5"):
+        parse_page_ranges("4-6", 5)
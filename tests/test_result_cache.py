@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from metrics import RESULT_CACHE_LOOKUPS, registry
+from result_cache import ResultCache, MemoryBackend, SQLiteBackend, make_cache_key
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / "results.sqlite3"))
+
+def test_expired_entries_miss_and_are_deleted(backend):
+    cache = ResultCache(backend, ttl=60, max_entries=10)
+    cache.set("old", {"n": 1})
+    backend.set("old", {"n": 1}, time.time() - 61)
+
+    assert cache.get("old") is None
+    assert backend.get("old") is None
+
+def test_entry_count_evicts_the_least_recently_used(backend):
+    cache = ResultCache(backend, ttl=60, max_entries=2)
+    cache.set("a", 1)
+    time.sleep(0.01)
+    cache.set("b", 2)
+    time.sleep(0.01)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == 1
+    time.sleep(0.01)
+    cache.set("c", 3)
+
+    assert backend.count() == 2
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+def test_set_drops_expired_entries(backend):
+    cache = ResultCache(backend, ttl=60, max_entries=10)
+    backend.set("old", 1, time.time() - 61)
+    cache.set("new", 2)
+
+    assert backend.count() == 1
+
+def test_hits_and_misses_are_counted(backend):
+    cache = ResultCache(backend, ttl=60, max_entries=10)
+    hits, misses = RESULT_CACHE_LOOKUPS.value("hit"), RESULT_CACHE_LOOKUPS.value("miss")
+    cache.set("key", {"n": 1})
+
+    assert cache.get("key") == {"n": 1}
+    assert cache.get("key") == {"n": 1}
+    assert cache.get("other") is None
+
+    assert RESULT_CACHE_LOOKUPS.value("hit") - hits == 2
+    assert RESULT_CACHE_LOOKUPS.value("miss") - misses == 1
+
+def test_cache_key_ignores_option_order():
+    page = b"page bytes"
+    first = make_cache_key(page, {"useDocUnwarping": True, "useTextlineOrientation": False}, 1)
+    second = make_cache_key(page, {"useTextlineOrientation": False, "useDocUnwarping": True}, 1)
+
+    assert first == second
+    assert make_cache_key(page, {"useDocUnwarping": False, "useTextlineOrientation": False}, 1) != first
+    assert make_cache_key(b"other page", {"useDocUnwarping": True, "useTextlineOrientation": False}, 1) != first
+    assert make_cache_key(page, {"useDocUnwarping": True, "useTextlineOrientation": False}, 0) != first
+
+def test_entry_count_is_exported_as_a_gauge():
+    from result_cache import result_cache
+
+    result_cache.backend.clear()
+    result_cache.set("key", {"n": 1})
+
+    assert "salestimate_result_cache_entries 1" in registry.render()
@@ -0,0 +1,89 @@
+import pytest
+
+from table_collation import parse_table_rows, collate_html_tables_to_json
+
+def texts(rows):
+    return [cells_text for _, cells_text in rows]
+
+def test_colspan_leaves_covered_cells_empty():
+    rows = parse_table_rows(
+        "<table><tr><td colspan='2'>Item</td><td>Qty</td></tr><tr><td>A</td><td>B</td><td>1</td></tr></table>", {}
+    )
+    assert texts(rows) == [["Item", "", "Qty"], ["A", "B", "1"]]
+
+def test_rowspan_reserves_the_column_in_following_rows():
+    rows = parse_table_rows(
+        "<table>"
+        "<tr><td rowspan='3'>Group</td><td>a</td></tr>"
+        "<tr><td>b</td></tr>"
+        "<tr><td>c</td></tr>"
+        "<tr><td>x</td><td>d</td></tr>"
+        "</table>",
+        {},
+    )
+    assert texts(rows) == [["Group", "a"], ["", "b"], ["", "c"], ["x", "d"]]
+
+def test_combined_colspan_and_rowspan():
+    rows = parse_table_rows(
+        "<table>"
+        "<tr><td rowspan='2' colspan='2'>Merged</td><td>r1</td></tr>"
+        "<tr><td>r2</td></tr>"
+        "<tr><td>a</td><td>b</td><td>c</td></tr>"
+        "</table>",
+        {},
+    )
+    assert texts(rows) == [["Merged", "", "r1"], ["", "", "r2"], ["a", "b", "c"]]
+
+def test_rowspan_past_the_end_of_a_shorter_row():
+    rows = parse_table_rows(
+        "<table><tr><td>a</td><td rowspan='2'>tall</td></tr><tr><td>b</td></tr></table>", {}
+    )
+    assert texts(rows) == [["a", "tall"], ["b", ""]]
+
+def test_colspan_overlapping_a_rowspan_consumes_it():
+    rows = parse_table_rows(
+        "<table>"
+        "<tr><td>a</td><td rowspan='2'>tall</td></tr>"
+        "<tr><td colspan='2'>wide</td></tr>"
+        "<tr><td>x</td><td>y</td></tr>"
+        "</table>",
+        {},
+    )
+    assert texts(rows) == [["a", "tall"], ["wide", ""], ["x", "y"]]
+
+def test_nested_tables_stay_inside_their_cell():
+    rows = parse_table_rows(
+        "<table><tr><td>outer<table><tr><td>inner</td></tr></table></td><td>2</td></tr></table>", {}
+    )
+    assert len(rows) == 1
+    assert rows[0][0][0] == "outer<table><tr><td>inner</td></tr></table>"
+    assert rows[0][1] == ["outerinner", "2"]
+
+def test_row_groups_close_cells_with_omitted_end_tags():
+    rows = parse_table_rows("<table><tbody><tr><td>1<td>2<td>3</tbody></table>", {})
+    assert rows == [(["1", "2", "3"], ["1", "2", "3"])]
+
+    rows = parse_table_rows(
+        "<table><thead><tr><th>Item<th>Qty</thead><tbody><tr><td>a<td>1<tbody><tr><td>b<td>2</table>", {}
+    )
+    assert rows == [(["Item", "Qty"], ["Item", "Qty"]), (["a", "1"], ["a", "1"]), (["b", "2"], ["b", "2"])]
+
+def test_image_sources_are_rewritten_through_the_image_map():
+    rows = parse_table_rows("<table><tr><td><img src='imgs/a.jpg'></td></tr></table>", {"imgs/a.jpg": "https://x/a.jpg"})
+    assert rows[0][0][0] == '<img src="https://x/a.jpg" style="max-width: 150px; height: auto;"/>'
+
+def test_repeated_headers_are_dropped_across_pages():
+    page = "<table><tr><td>Item</td><td>Qty</td></tr><tr><td>{}</td><td>1</td></tr></table>"
+    table = collate_html_tables_to_json([page.format("a"), "<p>no table</p>", page.format("b")], [{}, {}, {}])
+    assert table == {"headers": ["Item", "Qty"], "data": [["a", "1"], ["b", "1"]]}
+
+def test_matches_the_legacy_collator_on_the_sample_document():
+    pytest.importorskip("bs4")
+    from bench_collation import build_document, legacy_collate_html_tables_to_json, _visible_text
+
+    html_parts, image_maps = build_document(pages=4, row_repeat=3)
+    legacy = legacy_collate_html_tables_to_json(html_parts, image_maps)
+    table = collate_html_tables_to_json(html_parts, image_maps)
+
+    assert table["headers"] == legacy["headers"]
+    assert [_visible_text(r) for r in table["data"]] == [_visible_text(r) for r in legacy["data"]]
@@ -0,0 +1,72 @@
+import time
+import base64
+
+from mock_layout_api import MockLayoutAPI, load_sample_pages
+import table_recognition
+from table_recognition import extract_table_from_image, extract_tables_from_images, api_result_to_table
+
+class EchoLayoutAPI(MockLayoutAPI):
+    """Answers with a table holding the uploaded bytes; earlier uploads answer more slowly."""
+
+    def handle(self, payload, body_size):
+        with self._lock:
+            self.requests += 1
+        content = base64.b64decode(payload["file"]).decode("ascii")
+        time.sleep(0.05 * (5 - int(content.split("-")[1])))
+        page = {"markdown": {"text": f"<table><tr><td>{content}</td></tr></table>", "images": {}}}
+        return 200, {"errorCode": 0, "result": {"layoutParsingResults": [page]}}
+
+def test_batch_results_come_back_in_input_order(mock_api):
+    mock_api(EchoLayoutAPI(load_sample_pages()))
+    images = [f"page-{i}".encode("ascii") for i in range(5)]
+
+    results = extract_tables_from_images(images, {})
+
+    assert [api_result_to_table(r)["html"] for r in results] == [
+        f"<table><tr><td>page-{i}</td></tr></table>" for i in range(5)
+    ]
+
+def test_batch_route_keeps_page_order_and_reports_missing_pages(mock_api):
+    from main import app
+    from page_cache import page_cache, make_page_id
+
+    mock_api(EchoLayoutAPI(load_sample_pages()))
+    doc_hash = "b" * 64
+    page_ids = [make_page_id(doc_hash, n, "300") for n in range(1, 5)]
+    for n, page_id in enumerate(page_ids):
+        if n != 2:
+            page_cache.put(page_id, f"page-{n}".encode("ascii"), b"thumbnail")
+
+    response = app.test_client().post("/extract_tables_batch", json={"page_ids": page_ids, "options": {}})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [r["page_id"] for r in results] == page_ids
+    assert results[0]["html"] == "<table><tr><td>page-0</td></tr></table>"
+    assert results[3]["html"] == "<table><tr><td>page-3</td></tr></table>"
+    assert "error" in results[2]
+
+def test_batch_route_rejects_malformed_requests():
+    from main import app
+
+    client = app.test_client()
+    for body in ({"page_ids": ["a" * 64, 7]}, {"page_ids": [{"id": 1}]}, {"page_ids": [], "options": []}, {"page_ids": [], "options": "x"}):
+        assert client.post("/extract_tables_batch", json=body).status_code == 400
+
+def test_service_unavailable_is_retried_until_it_succeeds(mock_api):
+    api = mock_api(fail_first=1, error_status=503)
+
+    result = extract_table_from_image(b"retried image", {})
+
+    assert "error" not in result
+    assert api.requests == 2
+    assert "<table" in api_result_to_table(result)["html"]
+
+def test_read_timeout_is_reported_without_retrying(mock_api, monkeypatch):
+    api = mock_api(latency=1.0)
+    monkeypatch.setattr(table_recognition, "API_TIMEOUT", 0.2)
+
+    result = extract_table_from_image(b"slow image", {})
+
+    assert result == {"error": "The Table Recognition API timed out."}
+    assert api.requests == 1